@@ -3,16 +3,30 @@ EFFICIENT PORTFOLIO OPTIMIZER - Web Application
 Analyzes 5 Blue-chip Nifty Stocks for Optimal Portfolio Allocation
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from itertools import combinations
 from scipy.optimize import minimize
+from scipy.special import ndtri
 import json
-import plotly.graph_objs as go
-import plotly.utils
-from kiteconnect import KiteConnect
+from dotenv import load_dotenv
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import closing
+from multiprocessing import shared_memory
 import os
+import hashlib
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+load_dotenv()
 
 app = Flask(__name__)
 
@@ -26,82 +40,696 @@ STOCKS = {
     'ICICIBANK': {'token': 1270529, 'name': 'ICICI Bank'}
 }
 
+# Default start of the history used for analysis
+DEFAULT_FROM_DATE = datetime.fromisoformat(os.getenv("DATA_FROM_DATE", "2023-01-01"))
+
+# Size of the random-portfolio cloud on the frontier chart
+RANDOM_PORTFOLIOS = int(os.getenv("RANDOM_PORTFOLIOS", "1000"))
+MAX_RANDOM_PORTFOLIOS = 1_000_000
+CLOUD_CHART_POINTS = 5000  # most cloud points sent to the chart (and kept in cached results)
+
 # Load Kite connection
 def get_kite_connection():
     """Load existing Kite connection from saved token"""
     try:
-        if not os.path.exists("token.txt"):
-            raise FileNotFoundError("token.txt not found. Please generate an access token.")
-        with open("token.txt", "r") as f:
-            access_token = f.read().strip()
+        access_token = os.getenv("KITE_ACCESS_TOKEN")
+        if not access_token:
+            if not os.path.exists("token.txt"):
+                raise FileNotFoundError("token.txt not found. Please generate an access token.")
+            with open("token.txt", "r") as f:
+                access_token = f.read().strip()
         API_KEY = os.getenv("KITE_API_KEY", "5igxd0bd1z16zc2p")
-        kite = KiteConnect(api_key=API_KEY)
+        from kiteconnect import KiteConnect  # imported lazily: it pulls in twisted
+        # KITE_ROOT_URL points the client at another API host, e.g. kite_stub_server.py
+        kite = KiteConnect(api_key=API_KEY, root=os.getenv("KITE_ROOT_URL") or None)
         kite.set_access_token(access_token)
-        kite.instruments()  # Verify connection
+        kite.profile()  # Verify connection with a cheap call
         return kite
     except Exception as e:
         print(f"Error loading Kite connection: {e}")
         return None
 
-# Global Kite instance
-kite = get_kite_connection()
+# Global Kite instance, created on first use so startup needs no network
+kite = None
+_kite_lock = threading.Lock()
+
+def get_kite():
+    """Return the shared Kite client, connecting on first use"""
+    global kite
+    if kite is None:
+        with _kite_lock:
+            if kite is None:
+                kite = get_kite_connection()
+    return kite
 
 # ========== DATA FETCHING ==========
-def fetch_stock_data(stock_token, from_date, to_date):
-    """Fetch historical data for a stock"""
+# Per-symbol OHLC cache (one .npz per instrument token)
+CACHE_DIR = os.getenv("OHLC_CACHE_DIR", "data_cache")
+OHLC_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+MARKET_CLOSE = os.getenv("MARKET_CLOSE", "15:30")  # local time after which today's bar is final
+
+def last_complete_day(now=None):
+    """Latest date whose daily bar is final: today after MARKET_CLOSE, else yesterday"""
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in MARKET_CLOSE.split(':'))
+    if now.time() >= now.replace(hour=hour, minute=minute).time():
+        return now.date()
+    return now.date() - timedelta(days=1)
+
+def _cache_path(stock_token):
+    return os.path.join(CACHE_DIR, f"{stock_token}.npz")
+
+def load_cached_ohlc(stock_token):
+    """Load cached bars for a stock as (df, covered_from, covered_to) or None"""
+    path = _cache_path(stock_token)
+    if not os.path.exists(path):
+        return None
     try:
-        all_data = []
-        current_date = from_date
-        while current_date < to_date:
-            chunk_end = min(current_date + timedelta(days=1999), to_date)
-            chunk_data = kite.historical_data(
-                stock_token, 
-                current_date, 
-                chunk_end, 
-                "day"
+        with np.load(path) as cached:
+            df = pd.DataFrame(
+                {field: cached[field] for field in OHLC_FIELDS},
+                index=pd.DatetimeIndex(cached['date'].astype('datetime64[ns]'), name='date')
             )
-            if not chunk_data:
-                print(f"No data returned for token {stock_token}")
-                return None
-            all_data.extend(chunk_data)
-            current_date = chunk_end + timedelta(days=1)
-        df = pd.DataFrame(all_data)
+            covered_from = pd.Timestamp(int(cached['covered'][0])).date()
+            covered_to = pd.Timestamp(int(cached['covered'][1])).date()
+        return df, covered_from, covered_to
+    except Exception as e:
+        print(f"Ignoring unreadable cache for token {stock_token}: {e}")
+        return None
+
+def save_cached_ohlc(stock_token, df, covered_from, covered_to):
+    """Atomically write cached bars for a stock"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(stock_token)
+    # A unique temp file per write: threads of one process may save the same token at once
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(
+            f,
+            date=df.index.values.astype('datetime64[ns]').astype(np.int64),
+            covered=np.array([pd.Timestamp(covered_from).value, pd.Timestamp(covered_to).value]),
+            **{field: df[field].to_numpy(dtype=float) for field in OHLC_FIELDS}
+        )
+    os.replace(tmp_path, path)
+
+# Instruments dump, cached on disk and refreshed at most once a day
+INSTRUMENTS_TTL = 24 * 60 * 60
+_instrument_tokens = {}
+
+def load_instruments(exchange="NSE"):
+    """Return a {tradingsymbol: instrument_token} index for an exchange"""
+    if exchange in _instrument_tokens:
+        loaded_at, index = _instrument_tokens[exchange]
+        if time.time() - loaded_at < INSTRUMENTS_TTL:
+            return index
+    path = os.path.join(CACHE_DIR, f"instruments_{exchange}.json")
+    index = None
+    loaded_at = time.time()
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < INSTRUMENTS_TTL:
+        # Expire together with the dump it came from
+        loaded_at = os.path.getmtime(path)
+        with open(path, "r") as f:
+            index = json.load(f)
+    else:
+        client = get_kite()
+        if client is not None:
+            try:
+                index = {
+                    row['tradingsymbol']: row['instrument_token']
+                    for row in client.instruments(exchange)
+                }
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+                with os.fdopen(fd, "w") as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Error loading instruments for {exchange}: {e}")
+        if index is None and os.path.exists(path):
+            # Offline: a stale dump is better than none
+            with open(path, "r") as f:
+                index = json.load(f)
+    if index is None:
+        return {}
+    _instrument_tokens[exchange] = (loaded_at, index)
+    return index
+
+def resolve_token(symbol):
+    """Instrument token for a symbol: STOCKS first, then the instruments dump"""
+    if symbol in STOCKS:
+        return STOCKS[symbol]['token']
+    return load_instruments().get(symbol)
+
+def _candles_to_frame(candles):
+    """Convert Kite candles to a date-indexed OHLC DataFrame (naive local dates)"""
+    df = pd.DataFrame(candles)
+    if df.empty:
+        return df
+    df['date'] = pd.to_datetime(df['date'])
+    if df['date'].dt.tz is not None:
+        df['date'] = df['date'].dt.tz_localize(None)
+    df.set_index('date', inplace=True)
+    return df[list(OHLC_FIELDS)]
+
+def _chunk_ranges(from_date, to_date, chunk_days=1999):
+    """Split a date range into the chunks accepted by Kite's historical API"""
+    ranges = []
+    current_date = from_date
+    while current_date <= to_date:
+        chunk_end = min(current_date + timedelta(days=chunk_days), to_date)
+        ranges.append((current_date, chunk_end))
+        current_date = chunk_end + timedelta(days=1)
+    return ranges
+
+def _missing_ranges(cached, from_date, to_date):
+    """Date ranges that must be requested from Kite given the cached bars"""
+    if cached is None:
+        return [(from_date, to_date)]
+    df, covered_from, covered_to = cached
+    ranges = []
+    # Only ask Kite for the days on either side of what is already cached
+    if from_date.date() < covered_from:
+        ranges.append((from_date, datetime.combine(covered_from - timedelta(days=1), datetime.min.time())))
+    if to_date.date() > covered_to:
+        # Re-request the last cached bar too, in case it was a partial intraday bar
+        tail_start = df.index[-1].to_pydatetime() if not df.empty else from_date
+        ranges.append((tail_start, to_date))
+    return ranges
+
+def _merge_cached(stock_token, cached, candles, from_date, to_date):
+    """Merge newly fetched candles into the cache and return the requested window
+
+    Coverage is recorded only up to the last completed session, so a partial
+    intraday bar is fetched again on the next request.
+    """
+    from_day, to_day = from_date.date(), to_date.date()
+    covered_day = min(to_day, last_complete_day())
+    fetched = _candles_to_frame(candles)
+    if cached is None:
+        df = fetched
         if df.empty:
             print(f"Empty data for token {stock_token}")
             return None
-        df['date'] = pd.to_datetime(df['date'])
-        df.set_index('date', inplace=True)
-        return df
-    except Exception as e:
-        print(f"Error fetching data for token {stock_token}: {e}")
+        save_cached_ohlc(stock_token, df, from_day, covered_day)
+    else:
+        df, covered_from, covered_to = cached
+        if from_day < covered_from or to_day > covered_to:
+            if not fetched.empty:
+                df = pd.concat([df, fetched])
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+            save_cached_ohlc(stock_token, df, min(from_day, covered_from), max(covered_day, covered_to))
+
+    df = df[(df.index >= pd.Timestamp(from_day)) & (df.index < pd.Timestamp(to_day) + pd.Timedelta(days=1))]
+    if df.empty:
+        print(f"No data returned for token {stock_token}")
         return None
+    return df
 
-def prepare_portfolio_data():
-    """Fetch and prepare data for all stocks"""
-    from_date = datetime(2023, 1, 1)
-    to_date = datetime.now()
-    
+class TokenBucket:
+    """Thread-safe token bucket limiting the request rate"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class FetchScheduler:
+    """Issues Kite historical requests in parallel under a shared rate limit"""
+
+    def __init__(self, max_workers=8, rate=3.0, retries=3, backoff=0.5):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kite-fetch')
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timings = {}
+
+    def _request(self, stock_token, from_date, to_date):
+        """One historical_data call with retry and exponential backoff"""
+        client = get_kite()
+        if client is None:
+            raise RuntimeError("Kite connection not available")
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                candles = client.historical_data(stock_token, from_date, to_date, "day")
+                return candles or [], time.monotonic()
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                print(f"Retrying token {stock_token} in {delay:.2f}s: {e}")
+                time.sleep(delay)
+
+    def fetch(self, tokens, from_date, to_date):
+        """Fetch {symbol: token} concurrently, returning {symbol: DataFrame or None}"""
+        pending = {}
+        for symbol, stock_token in tokens.items():
+            cached = load_cached_ohlc(stock_token)
+            futures = [
+                self.executor.submit(self._request, stock_token, chunk_start, chunk_end)
+                for range_start, range_end in _missing_ranges(cached, from_date, to_date)
+                for chunk_start, chunk_end in _chunk_ranges(range_start, range_end)
+            ]
+            pending[symbol] = (stock_token, cached, futures, time.monotonic())
+
+        results = {}
+        for symbol, (stock_token, cached, futures, started) in pending.items():
+            try:
+                responses = [future.result() for future in futures]
+                candles = [candle for chunk, _ in responses for candle in chunk]
+                finished = max((done for _, done in responses), default=started)
+                results[symbol] = _merge_cached(stock_token, cached, candles, from_date, to_date)
+            except Exception as e:
+                print(f"Error fetching data for {symbol}: {e}")
+                finished = time.monotonic()
+                results[symbol] = None
+            self.timings[symbol] = {'seconds': round(finished - started, 3), 'requests': len(futures)}
+            print(f"Fetched {symbol} in {finished - started:.2f}s ({len(futures)} requests)")
+        return results
+
+# Shared scheduler so every request respects Kite's ~3 req/s historical limit
+fetch_scheduler = FetchScheduler(
+    max_workers=int(os.getenv("KITE_FETCH_WORKERS", "8")),
+    rate=float(os.getenv("KITE_HISTORICAL_RATE", "3"))
+)
+
+def fetch_stock_data(stock_token, from_date, to_date):
+    """Fetch historical data for a stock, reading the local cache first"""
+    return fetch_scheduler.fetch({stock_token: stock_token}, from_date, to_date)[stock_token]
+
+# ========== MARKET DATA PROVIDERS ==========
+class MarketDataProvider:
+    """Source of daily OHLC bars; subclasses implement fetch()"""
+
+    name = 'base'
+
+    def fetch(self, symbols, from_date, to_date):
+        """Return {symbol: DataFrame or None} of date-indexed OHLC bars"""
+        raise NotImplementedError
+
+class KiteProvider(MarketDataProvider):
+    """Kite historical API, through the on-disk cache and rate-limited scheduler"""
+
+    name = 'kite'
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def fetch(self, symbols, from_date, to_date):
+        tokens = {symbol: resolve_token(symbol) for symbol in symbols}
+        unknown = [symbol for symbol, token in tokens.items() if token is None]
+        if unknown:
+            raise ValueError(f"Unknown stocks: {', '.join(unknown)}")
+        return self.scheduler.fetch(tokens, from_date, to_date)
+
+class LocalFileProvider(MarketDataProvider):
+    """Bars from <directory>/<SYMBOL>.parquet or <SYMBOL>.csv (columns: date + OHLC)"""
+
+    name = 'local'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames = {}  # path -> (mtime, DataFrame), so repeat loads run at memory speed
+
+    def _path(self, symbol):
+        for extension in ('.parquet', '.csv'):
+            path = os.path.join(self.directory, f"{symbol}{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _load(self, path):
+        mtime = os.path.getmtime(path)
+        if path in self.frames and self.frames[path][0] == mtime:
+            return self.frames[path][1]
+        if path.endswith('.parquet'):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path)
+        if 'date' in df.columns:
+            df = df.set_index('date')
+        df.index = pd.to_datetime(df.index)
+        if df.index.tz is not None:
+            df.index = df.index.tz_localize(None)
+        df = df.sort_index()
+        self.frames[path] = (mtime, df)
+        return df
+
+    def fetch(self, symbols, from_date, to_date):
+        paths = {symbol: self._path(symbol) for symbol in symbols}
+        unknown = [symbol for symbol, path in paths.items() if path is None]
+        if unknown:
+            raise ValueError(f"Unknown stocks: {', '.join(unknown)}")
+        results = {}
+        for symbol, path in paths.items():
+            df = self._load(path)
+            df = df[(df.index >= pd.Timestamp(from_date.date())) & (df.index < pd.Timestamp(to_date.date()) + pd.Timedelta(days=1))]
+            results[symbol] = df if not df.empty else None
+        return results
+
+class SyntheticProvider(MarketDataProvider):
+    """Seeded one-factor geometric Brownian motion bars on a business-day calendar
+
+    Every symbol is accepted. Series are generated over a fixed calendar and
+    then sliced, so any window of a symbol is consistent with every other.
+    """
+
+    name = 'synthetic'
+    start = datetime(2000, 1, 3)
+
+    def __init__(self, seed=42, market_vol=0.18, idio_vol=0.20, drift=0.12):
+        self.seed = seed
+        self.market_vol = market_vol
+        self.idio_vol = idio_vol
+        self.drift = drift
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _calendar(self, to_date):
+        days = np.arange(np.datetime64(self.start.date()), np.datetime64(to_date.date()) + 1)
+        return pd.DatetimeIndex(days[np.is_busday(days)], name='date')
+
+    def _market(self, n_days):
+        rng = np.random.default_rng(self.seed)
+        return rng.standard_normal(n_days)
+
+    def _generate(self, symbol, dates):
+        # One stream per array, so extending the calendar never changes earlier bars
+        key = zlib.crc32(symbol.encode())
+        params, idio, wicks, volume = (np.random.default_rng([self.seed, key, i]) for i in range(4))
+        beta = params.uniform(0.6, 1.4)
+        drift = self.drift * params.uniform(0.3, 1.7)
+        idio_vol = self.idio_vol * params.uniform(0.6, 1.4)
+        level = 100 * params.uniform(0.5, 20)
+        daily = np.sqrt(1 / TRADING_DAYS)
+        log_returns = (drift / TRADING_DAYS
+                       + beta * self.market_vol * daily * self._market(len(dates))
+                       + idio_vol * daily * idio.standard_normal(len(dates)))
+        close = level * np.exp(np.cumsum(log_returns))
+        spread = np.abs(wicks.standard_normal(len(dates))) * idio_vol * daily * close
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        return pd.DataFrame({
+            'open': open_,
+            'high': np.maximum(open_, close) + spread,
+            'low': np.minimum(open_, close) - spread,
+            'close': close,
+            'volume': volume.integers(100_000, 5_000_000, len(dates)).astype(float)
+        }, index=dates)
+
+    def fetch(self, symbols, from_date, to_date):
+        results = {}
+        for symbol in symbols:
+            with self.lock:
+                df = self.series.get(symbol)
+                if df is None or df.index[-1] < pd.Timestamp(to_date.date()) - pd.offsets.BDay(1):
+                    df = self.series[symbol] = self._generate(symbol, self._calendar(to_date))
+            df = df[(df.index >= pd.Timestamp(from_date.date())) & (df.index < pd.Timestamp(to_date.date()) + pd.Timedelta(days=1))]
+            results[symbol] = df if not df.empty else None
+        return results
+
+def create_market_data_provider(kind=None):
+    """Build the provider named by MARKET_DATA_PROVIDER (kite, local or synthetic)"""
+    kind = (kind or os.getenv("MARKET_DATA_PROVIDER", "kite")).lower()
+    if kind == 'kite':
+        return KiteProvider(fetch_scheduler)
+    if kind == 'local':
+        return LocalFileProvider(os.getenv("MARKET_DATA_DIR", "market_data"))
+    if kind == 'synthetic':
+        return SyntheticProvider(seed=int(os.getenv("SYNTHETIC_SEED", "42")))
+    raise ValueError(f"Unknown market data provider: {kind}")
+
+market_data = create_market_data_provider()
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one in-flight execution"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def join(self, key):
+        """(future, leader); the leader must resolve the key with finish()"""
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = self.calls[key] = Future()
+            return future, True
+
+    def finish(self, key, result=None, error=None):
+        with self.lock:
+            future = self.calls.pop(key)
+        if error is not None:
+            if not isinstance(error, Exception):
+                # The leader was interrupted (GeneratorExit, SystemExit, a timeout): fail followers plainly
+                error = RuntimeError(f"Shared call was interrupted: {error!r}")
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """fn(*args, **kwargs), or the result of an identical call already running"""
+        future, leader = self.join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            # Always release the key, or every later caller would wait on it forever
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+
+# Concurrent loads of the same symbols and window share one provider fetch
+data_flight = SingleFlight()
+
+def prepare_portfolio_data(symbols=None, from_date=None, to_date=None):
+    """Fetch and prepare aligned data for the given stocks (default: all STOCKS)"""
+    symbols = list(STOCKS) if symbols is None else list(symbols)
+    from_date = from_date or DEFAULT_FROM_DATE
+    to_date = to_date or datetime.now()
+    key = (market_data.name, tuple(symbols), pd.Timestamp(from_date).date(), pd.Timestamp(to_date).date())
+    return data_flight.do(key, _load_portfolio_data, symbols, from_date, to_date)
+
+def _load_portfolio_data(symbols, from_date, to_date):
     stock_data = {}
     returns_data = {}
     
-    for symbol, info in STOCKS.items():
-        print(f"Fetching {symbol}...")
-        df = fetch_stock_data(info['token'], from_date, to_date)
+    print(f"Fetching {', '.join(symbols)} from {market_data.name}...")
+    fetched = market_data.fetch(symbols, from_date, to_date)
+    for symbol, df in fetched.items():
         if df is not None and not df.empty:
             stock_data[symbol] = df
             returns_data[symbol] = df['close'].pct_change().dropna()
     
-    # Create combined returns DataFrame
+    # Create combined returns DataFrame, aligned on common dates and in request order
     returns_df = pd.DataFrame(returns_data).dropna()
+    returns_df = returns_df[[symbol for symbol in symbols if symbol in returns_df.columns]]
     
     return stock_data, returns_df
 
 # ========== PORTFOLIO OPTIMIZATION ==========
-def calculate_portfolio_metrics(weights, returns_df):
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.06  # 6% risk-free rate
+
+def returns_version(returns_df):
+    """Content hash of a returns panel, independent of column order"""
+    return hashlib.sha1(
+        pd.util.hash_pandas_object(returns_df[sorted(returns_df.columns)], index=True).values.tobytes()
+    ).hexdigest()[:16]
+
+class PortfolioModel:
+    """Annualised mean/covariance of a returns panel, computed once and reused"""
+
+    def __init__(self, returns_df, risk_free_rate=RISK_FREE_RATE):
+        self.symbols = list(returns_df.columns)
+        self.n_assets = len(self.symbols)
+        self.rf = risk_free_rate
+        self.mu = returns_df.mean().values * TRADING_DAYS
+        self.Sigma = returns_df.cov().values * TRADING_DAYS
+        self._L = None
+        # Data window and a content hash of the panel, independent of column order
+        self.window = (str(returns_df.index[0]), str(returns_df.index[-1])) if len(returns_df) else None
+        self.version = returns_version(returns_df)
+
+    @classmethod
+    def from_moments(cls, symbols, mu, Sigma, risk_free_rate=RISK_FREE_RATE, window=None, version=None):
+        """Build a model from precomputed annualised moments"""
+        model = cls.__new__(cls)
+        model.symbols = list(symbols)
+        model.n_assets = len(model.symbols)
+        model.rf = risk_free_rate
+        model.mu = np.asarray(mu, dtype=float)
+        model.Sigma = np.asarray(Sigma, dtype=float)
+        model._L = None
+        model.window = window
+        model.version = version
+        return model
+
+    def select(self, symbols):
+        """Model restricted to (or reordered as) the given symbols"""
+        idx = [self.symbols.index(symbol) for symbol in symbols]
+        return PortfolioModel.from_moments(
+            symbols, self.mu[idx], self.Sigma[np.ix_(idx, idx)],
+            risk_free_rate=self.rf, window=self.window, version=self.version
+        )
+
+    @property
+    def L(self):
+        """Cholesky factor of Sigma, computed on first use"""
+        if self._L is None:
+            self._L = self._cholesky(self.Sigma)
+        return self._L
+
+    @staticmethod
+    def _cholesky(Sigma):
+        """Cholesky factor, with a small ridge if Sigma is only semi-definite"""
+        try:
+            return np.linalg.cholesky(Sigma)
+        except np.linalg.LinAlgError:
+            ridge = 1e-10 * max(np.trace(Sigma) / len(Sigma), 1e-12)
+            return np.linalg.cholesky(Sigma + ridge * np.eye(len(Sigma)))
+
+    def ret(self, w):
+        """Annual expected return of weights w"""
+        return float(self.mu @ w)
+
+    def cov_mul(self, w):
+        """Sigma @ w (w a vector, or weight vectors as columns)"""
+        return self.Sigma @ w
+
+    def batch_variance(self, weights):
+        """Annual variance of each row of a weights matrix"""
+        # w' Sigma w == ||L' w||^2 for Sigma = L L'
+        projected = weights @ self.L
+        return np.einsum('ij,ij->i', projected, projected)
+
+    def risk(self, w):
+        """Annual volatility of weights w"""
+        return float(np.sqrt(self.variance(w)))
+
+    def sharpe(self, w):
+        """Sharpe ratio of weights w"""
+        return (self.ret(w) - self.rf) / self.risk(w)
+
+    def variance(self, w):
+        """Annual variance of weights w"""
+        return float(w @ self.cov_mul(w))
+
+    def ret_grad(self, w):
+        """Gradient of ret(w)"""
+        return self.mu
+
+    def variance_grad(self, w):
+        """Gradient of variance(w)"""
+        return 2 * self.cov_mul(w)
+
+    def risk_grad(self, w):
+        """Gradient of risk(w)"""
+        Sigma_w = self.cov_mul(w)
+        return Sigma_w / np.sqrt(w @ Sigma_w)
+
+    def sharpe_grad(self, w):
+        """Gradient of sharpe(w)"""
+        Sigma_w = self.cov_mul(w)
+        risk = np.sqrt(w @ Sigma_w)
+        return self.mu / risk - (self.mu @ w - self.rf) * Sigma_w / risk ** 3
+
+FACTOR_MODEL_MIN_ASSETS = int(os.getenv("FACTOR_MODEL_MIN_ASSETS", "100"))  # use a factor model from this size
+FACTOR_MODEL_FACTORS = int(os.getenv("FACTOR_MODEL_FACTORS", "10"))
+
+class FactorModel(PortfolioModel):
+    """PortfolioModel whose covariance is B B' + diag(d): k statistical (PCA) factors plus specific risk
+
+    Risk, its gradients and the random cloud cost O(nk) instead of O(n^2) and no n x n
+    matrix is stored; Sigma and L are only built (once) for solvers that need them dense,
+    such as the Critical Line Algorithm and the max-Sharpe QP.
+    """
+
+    def __init__(self, returns_df, n_factors=FACTOR_MODEL_FACTORS, risk_free_rate=RISK_FREE_RATE):
+        centered = returns_df.values - returns_df.values.mean(axis=0)
+        n_factors = min(n_factors, *centered.shape)
+        _, singular_values, components = np.linalg.svd(centered, full_matrices=False)
+        scale = TRADING_DAYS / (len(centered) - 1)
+        B = components[:n_factors].T * (singular_values[:n_factors] * np.sqrt(scale))
+        total_variance = (centered ** 2).sum(axis=0) * scale
+        # Specific variance, floored so the covariance stays positive definite
+        d = np.maximum(total_variance - (B ** 2).sum(axis=1), 1e-6 * total_variance)
+        self._set_factors(
+            returns_df.columns, returns_df.mean().values * TRADING_DAYS, B, d, risk_free_rate,
+            window=(str(returns_df.index[0]), str(returns_df.index[-1])) if len(returns_df) else None,
+            version=f"{returns_version(returns_df)}-k{n_factors}"
+        )
+
+    @classmethod
+    def from_factors(cls, symbols, mu, B, d, risk_free_rate=RISK_FREE_RATE, window=None, version=None):
+        """Build a model from annualised mean, factor loadings and specific variances"""
+        model = cls.__new__(cls)
+        model._set_factors(symbols, mu, B, d, risk_free_rate, window, version)
+        return model
+
+    def _set_factors(self, symbols, mu, B, d, risk_free_rate, window, version):
+        self.symbols = list(symbols)
+        self.n_assets = len(self.symbols)
+        self.rf = risk_free_rate
+        self.mu = np.asarray(mu, dtype=float)
+        self.B = np.asarray(B, dtype=float)
+        self.d = np.asarray(d, dtype=float)
+        self.window = window
+        self.version = version
+        self._Sigma = self._L = None
+
+    @property
+    def Sigma(self):
+        """Dense covariance, built on first use"""
+        if self._Sigma is None:
+            self._Sigma = self.B @ self.B.T + np.diag(self.d)
+        return self._Sigma
+
+    def select(self, symbols):
+        idx = [self.symbols.index(symbol) for symbol in symbols]
+        return FactorModel.from_factors(
+            symbols, self.mu[idx], self.B[idx], self.d[idx],
+            risk_free_rate=self.rf, window=self.window, version=self.version
+        )
+
+    def cov_mul(self, w):
+        return self.B @ (self.B.T @ w) + (self.d * w.T).T
+
+    def batch_variance(self, weights):
+        projected = weights @ self.B
+        return np.einsum('ij,ij->i', projected, projected) + (weights ** 2) @ self.d
+
+def build_portfolio_model(returns_df, risk_free_rate=RISK_FREE_RATE):
+    """Dense model for small universes, factor model from FACTOR_MODEL_MIN_ASSETS assets"""
+    if FACTOR_MODEL_MIN_ASSETS and returns_df.shape[1] >= FACTOR_MODEL_MIN_ASSETS:
+        return FactorModel(returns_df, risk_free_rate=risk_free_rate)
+    return PortfolioModel(returns_df, risk_free_rate)
+
+def calculate_portfolio_metrics(weights, model):
     """Calculate portfolio return, risk, and Sharpe ratio"""
-    portfolio_return = np.sum(returns_df.mean() * weights) * 252
-    portfolio_std = np.sqrt(np.dot(weights.T, np.dot(returns_df.cov() * 252, weights)))
-    sharpe_ratio = (portfolio_return - 0.06) / portfolio_std  # 6% risk-free rate
+    if not isinstance(model, PortfolioModel):
+        model = PortfolioModel(model)
+    weights = np.asarray(weights, dtype=float)
+    portfolio_return = model.ret(weights)
+    portfolio_std = model.risk(weights)
+    sharpe_ratio = (portfolio_return - model.rf) / portfolio_std
     
     return {
         'return': float(portfolio_return * 100),
@@ -109,31 +737,152 @@ def calculate_portfolio_metrics(weights, returns_df):
         'sharpe': float(sharpe_ratio)
     }
 
-def optimize_portfolio(returns_df, optimization_type='sharpe'):
+def evaluate_portfolios(model, weights, confidence=0.95, horizon_days=1):
+    """Metrics for each row of a weights matrix, in percent like calculate_portfolio_metrics
+
+    VaR is the parametric (normal) loss not exceeded with the given confidence over
+    horizon_days; risk contributions are each asset's share of portfolio variance.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    Sigma_w = model.cov_mul(weights.T).T
+    variance = np.einsum('ij,ij->i', weights, Sigma_w)
+    returns = weights @ model.mu
+    risks = np.sqrt(variance)
+    horizon = horizon_days / TRADING_DAYS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'return': returns * 100,
+            'risk': risks * 100,
+            'sharpe': (returns - model.rf) / risks,
+            'var': (ndtri(confidence) * risks * np.sqrt(horizon) - returns * horizon) * 100,
+            'risk_contributions': weights * Sigma_w / variance[:, None] * 100
+        }
+
+def _budget_constraint():
+    """Fully-invested constraint sum(w) == 1 with its Jacobian"""
+    return {'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)}
+
+def _target_return_constraint(model, target_return):
+    """Equality constraint ret(w) == target_return with its Jacobian"""
+    return {'type': 'eq', 'fun': lambda x: model.ret(x) - target_return, 'jac': model.ret_grad}
+
+def solve_nonneg_qp(Q, a, max_iter=None, tol=1e-12):
+    """Primal active-set solver for min 1/2 x'Qx s.t. a'x = 1, x >= 0 (Q positive definite)
+
+    Keeps the inverse of Q on the free set up to date with O(k^2) updates,
+    so each active-set change costs O(k^2) instead of a fresh factorisation.
+    A singular Q (fewer observations than assets, or a constant asset) is retried
+    with a small ridge, as in PortfolioModel._cholesky. Returns None if no feasible
+    point exists (a has no positive entry) or the ridged problem still breaks down.
+    """
+    if not np.any(a > 0):
+        return None
+    x = _active_set_qp(Q, a, max_iter, tol)
+    if x is None:
+        ridge = 1e-8 * max(np.trace(Q) / len(Q), 1e-12)
+        x = _active_set_qp(Q + ridge * np.eye(len(Q)), a, max_iter, tol)
+    return x
+
+def _active_set_qp(Q, a, max_iter, tol):
+    """solve_nonneg_qp without regularisation; None when Q is singular on the free set"""
+    n = len(a)
+    scale = max(np.abs(np.diag(Q)).max(), 1e-300)
+    start = int(np.argmax(a))
+    if not Q[start, start] > 1e-12 * scale:
+        return None
+    x = np.zeros(n)
+    x[start] = 1 / a[start]
+    free = [start]
+    Q_inv = np.array([[1 / Q[start, start]]])
+
+    for _ in range(max_iter or 10 * n + 10):
+        # Equality-constrained minimiser on the free set: x_F = Q_FF^-1 a_F / (a_F' Q_FF^-1 a_F)
+        z = Q_inv @ a[free]
+        nu = 1 / (a[free] @ z)
+        step = z * nu - x[free]
+
+        if not np.isfinite(step).all():
+            return None
+        if np.abs(step).max() <= 1e-10 * max(1.0, np.abs(x).max()):
+            # Stationary on the free set: check the multipliers of the active bounds
+            bounded = np.setdiff1d(np.arange(n), free)
+            if not len(bounded):
+                return x
+            multipliers = Q[bounded] @ x - nu * a[bounded]
+            j = int(np.argmin(multipliers))
+            if multipliers[j] >= -tol * scale * max(1.0, np.abs(x).max()):
+                return x
+            i = int(bounded[j])
+            Q_inv = _inverse_with(Q_inv, Q[free, i], Q[i, i])
+            # The new diagonal entry is 1 / Schur complement: near-zero complement means singular
+            if not np.isfinite(Q_inv).all() or not 0 < 1e-12 * scale * Q_inv[-1, -1] < 1:
+                return None
+            free.append(i)
+            continue
+
+        # Move towards the free-set minimiser, stopping at the first bound hit
+        shrinking = step < 0
+        ratios = np.full(len(free), np.inf)
+        ratios[shrinking] = -x[free][shrinking] / step[shrinking]
+        j = int(np.argmin(ratios))
+        alpha = min(1.0, ratios[j])
+        x[free] += alpha * step
+        if alpha < 1.0:
+            x[free[j]] = 0.0
+            Q_inv = _inverse_without(Q_inv, j)
+            free.pop(j)
+    return x if np.isfinite(x).all() else None
+
+def max_sharpe_qp(model):
+    """Max-Sharpe weights via the convex homogenised problem
+
+    With y = w / k and (mu - rf)'y = 1, maximising Sharpe becomes
+    min y' Sigma y s.t. (mu - rf)'y = 1, y >= 0, and w = y / sum(y).
+    Returns None when no asset beats the risk-free rate.
+    """
+    y = solve_nonneg_qp(model.Sigma, model.mu - model.rf)
+    if y is None or y.sum() <= 0:
+        return None
+    return y / y.sum()
+
+def optimize_portfolio(model, optimization_type='sharpe', analytic_gradients=True):
     """Find optimal portfolio weights"""
-    n_assets = len(returns_df.columns)
+    if not isinstance(model, PortfolioModel):
+        model = PortfolioModel(model)
+    n_assets = model.n_assets
     
     # Constraints and bounds
-    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
+    constraints = [_budget_constraint()]
     bounds = tuple((0, 1) for _ in range(n_assets))
     initial_weights = np.array([1/n_assets] * n_assets)
     
     if optimization_type == 'sharpe':
-        # Maximize Sharpe ratio
+        # Maximize Sharpe ratio as a convex QP when some asset beats the risk-free rate
+        weights = max_sharpe_qp(model)
+        if weights is not None:
+            return weights
+        
+        # Otherwise the problem is not homogenisable: fall back to SLSQP on -Sharpe
         def negative_sharpe(weights):
-            metrics = calculate_portfolio_metrics(weights, returns_df)
-            return -metrics['sharpe']
+            return -model.sharpe(weights)
+        
+        def negative_sharpe_grad(weights):
+            return -model.sharpe_grad(weights)
         
         result = minimize(negative_sharpe, initial_weights, 
+                         jac=negative_sharpe_grad if analytic_gradients else None,
                          method='SLSQP', bounds=bounds, constraints=constraints)
     
     elif optimization_type == 'min_risk':
-        # Minimize risk
+        # Minimize risk (in percent, so SLSQP's default tolerance stays meaningful)
         def portfolio_risk(weights):
-            metrics = calculate_portfolio_metrics(weights, returns_df)
-            return metrics['risk']
+            return model.risk(weights) * 100
+        
+        def portfolio_risk_grad(weights):
+            return model.risk_grad(weights) * 100
         
         result = minimize(portfolio_risk, initial_weights,
+                         jac=portfolio_risk_grad if analytic_gradients else None,
                          method='SLSQP', bounds=bounds, constraints=constraints)
     
     else:  # Custom weights
@@ -143,91 +892,1476 @@ def optimize_portfolio(returns_df, optimization_type='sharpe'):
         return result.x
     return None
 
-def generate_efficient_frontier(returns_df, n_portfolios=50):
-    """Generate efficient frontier data"""
-    n_assets = len(returns_df.columns)
-    
-    # Generate random portfolios
-    np.random.seed(42)
-    random_weights = []
-    random_returns = []
-    random_risks = []
-    random_sharpes = []
+# ========== COVARIANCE ESTIMATION ==========
+COVARIANCE_MODE = os.getenv("COVARIANCE_MODE", "expanding")  # expanding, rolling or ewma
+COVARIANCE_LOOKBACK = int(os.getenv("COVARIANCE_LOOKBACK", "252"))  # rows kept in rolling mode
+COVARIANCE_HALFLIFE = float(os.getenv("COVARIANCE_HALFLIFE", "63"))  # rows, for ewma mode
+
+class CovarianceEstimator:
+    """Running mean and covariance of return rows, updated in O(n^2) per new row
+
+    'expanding' uses the whole history (Welford), 'rolling' the last `lookback` rows
+    (add the new row, remove the oldest) and 'ewma' exponential weights with `halflife`.
+    """
+
+    def __init__(self, symbols, mode='expanding', lookback=252, halflife=63):
+        if mode not in ('expanding', 'rolling', 'ewma'):
+            raise ValueError(f"Unknown covariance mode: {mode}")
+        self.symbols = list(symbols)
+        self.mode = mode
+        self.lookback = lookback
+        self.alpha = 1 - 0.5 ** (1 / halflife)
+        self.rows_seen = 0  # every row applied, including those rolled out of the window
+        self._reset()
+
+    def _reset(self):
+        n_assets = len(self.symbols)
+        self.count = 0
+        self.mean = np.zeros(n_assets)
+        # Sum of outer products of deviations; the covariance itself in ewma mode
+        self.comoment = np.zeros((n_assets, n_assets))
+        self.rows = deque()  # (date, row) inside the rolling window
+        self.start_date = None
+        self.first_date = None
+        self.last_date = None
+
+    def add(self, date, row):
+        """Rank-one update with one new row of daily returns"""
+        row = np.asarray(row, dtype=float)
+        if self.start_date is None:
+            self.start_date = self.first_date = date
+        self.last_date = date
+        if self.mode == 'ewma':
+            if self.count == 0:
+                self.mean = row.copy()
+            else:
+                diff = row - self.mean
+                self.mean += self.alpha * diff
+                self.comoment = (1 - self.alpha) * (self.comoment + self.alpha * np.outer(diff, diff))
+            self.count += 1
+            return
+        self.count += 1
+        diff = row - self.mean
+        self.mean += diff / self.count
+        self.comoment += np.outer(diff, row - self.mean)
+        if self.mode == 'rolling':
+            self.rows.append((date, row))
+            if len(self.rows) > self.lookback:
+                self._remove(self.rows.popleft()[1])
+            self.first_date = self.rows[0][0]
+
+    def _remove(self, row):
+        """Inverse Welford step, for the row leaving the rolling window"""
+        self.count -= 1
+        diff = row - self.mean
+        self.mean -= diff / self.count
+        self.comoment -= np.outer(diff, row - self.mean)
+
+    def _merge(self, count, mean, comoment):
+        """Combine with the statistics of a block of rows (Chan et al.)"""
+        total = self.count + count
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+
+    def update(self, returns_df):
+        """Apply the rows of returns_df dated after the last one seen; returns how many"""
+        new = returns_df[self.symbols]
+        if self.last_date is not None:
+            new = new[new.index > self.last_date]
+        if new.empty:
+            return 0
+        self.rows_seen += len(new)
+        if self.mode == 'expanding':
+            values = new.values
+            block_mean = values.mean(axis=0)
+            centered = values - block_mean
+            self._merge(len(values), block_mean, centered.T @ centered)
+            if self.start_date is None:
+                self.start_date = self.first_date = new.index[0]
+            self.last_date = new.index[-1]
+            return len(new)
+        applied = new
+        if self.mode == 'rolling' and len(new) >= self.lookback:
+            # Everything seen so far drops out of the window
+            start_date = self.start_date if self.start_date is not None else new.index[0]
+            self._reset()
+            self.start_date = start_date
+            new = new.iloc[-self.lookback:]
+        for date, row in zip(new.index, new.values):
+            self.add(date, row)
+        return len(applied)
+
+    def covariance(self):
+        """Annualised covariance matrix"""
+        if self.mode == 'ewma':
+            return self.comoment * TRADING_DAYS
+        return self.comoment / (self.count - 1) * TRADING_DAYS
+
+    def to_model(self, risk_free_rate=RISK_FREE_RATE):
+        """PortfolioModel from the current moments, without revisiting the history"""
+        mu = self.mean * TRADING_DAYS
+        Sigma = self.covariance()
+        return PortfolioModel.from_moments(
+            self.symbols, mu, Sigma, risk_free_rate=risk_free_rate,
+            window=(str(self.first_date), str(self.last_date)),
+            version=hashlib.sha1(mu.tobytes() + Sigma.tobytes()).hexdigest()[:16]
+        )
+
+# ========== EFFICIENT FRONTIER ==========
+def _inverse_with(A_inv, b, c):
+    """Inverse of [[A, b], [b', c]] from A^-1 in O(k^2)"""
+    u = A_inv @ b
+    s = c - b @ u
+    k = len(b)
+    out = np.empty((k + 1, k + 1))
+    out[:k, :k] = A_inv + np.outer(u, u) / s
+    out[:k, k] = out[k, :k] = -u / s
+    out[k, k] = 1 / s
+    return out
+
+def _inverse_without(A_inv, j):
+    """Inverse of A with row/column j removed, from A^-1 in O(k^2)"""
+    keep = np.r_[0:j, j + 1:len(A_inv)]
+    f = A_inv[keep, j]
+    return A_inv[np.ix_(keep, keep)] - np.outer(f, f) / A_inv[j, j]
+
+def critical_line(model, tol=1e-10):
+    """Markowitz Critical Line Algorithm for the long-only, fully invested frontier
+
+    Returns (corners, lambdas): corner portfolio weights ordered from the
+    max-return corner down to the minimum-variance corner (lambda == 0).
+    Between consecutive corners the efficient weights are linear in return.
+    """
+    mu, Sigma = model.mu, model.Sigma
+    n = model.n_assets
+    lower, upper = np.zeros(n), np.ones(n)
+
+    # Start at the max-return corner. Assets tied for the top mean all belong to it,
+    # so take the least-variance mix of them rather than the first one alone.
+    w = lower.copy()
+    tied = np.flatnonzero(mu >= mu.max() - tol * max(1.0, abs(mu.max())))
+    mix = solve_nonneg_qp(Sigma[np.ix_(tied, tied)], np.ones(len(tied))) if len(tied) > 1 else None
+    if mix is None:
+        mix = np.eye(len(tied))[0]
+    w[tied] = mix
+    free = [int(i) for i in tied[mix > tol]]
+
+    corners, lambdas = [w.copy()], [np.inf]
+    Sigma_inv = np.linalg.inv(Sigma[np.ix_(free, free)])
+    while True:
+        bounded = np.setdiff1d(np.arange(n), free)
+        mu_F = mu[free]
+        a1 = Sigma_inv.sum(axis=1)                 # Sigma_FF^-1 1
+        am = Sigma_inv @ mu_F                      # Sigma_FF^-1 mu_F
+        c1, c3 = a1.sum(), am.sum()
+        g_all = Sigma[:, bounded] @ w[bounded]     # Sigma_{.,B} w_B
+        l1 = w[bounded].sum()
+        l3 = Sigma_inv @ g_all[free]
+        l2 = l3.sum()
+
+        # Events must strictly lower lambda, or round-off can bound and free the same asset forever
+        lambda_cap = lambdas[-1] - 1e-9 * max(1.0, abs(lambdas[-1])) if np.isfinite(lambdas[-1]) else np.inf
+
+        # Case a: a free weight hits one of its bounds
+        lambda_in, i_in, bound_in = -np.inf, None, None
+        if len(free) > 1:
+            c = -c1 * am + c3 * a1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bound = np.where(c > 0, upper[free], lower[free])
+                lam = ((1 - l1 + l2) * a1 - c1 * (bound + l3)) / c
+            lam[(np.abs(c) < tol) | (lam >= lambda_cap) | ~np.isfinite(lam)] = -np.inf
+            j = int(np.argmax(lam))
+            lambda_in, i_in, bound_in = lam[j], free[j], bound[j]
+
+        # Case b: a bounded weight becomes free (bordered inverse of Sigma_FF)
+        lambda_out, i_out = -np.inf, None
+        if len(bounded):
+            b = Sigma[np.ix_(free, bounded)]
+            U = Sigma_inv @ b
+            s = Sigma[bounded, bounded] - np.einsum('ij,ij->j', b, U)
+            u1 = U.sum(axis=0)
+            um = U.T @ mu_F
+            w_b = w[bounded]
+            uv = U.T @ g_all[free] - np.einsum('ij,ij->j', U, b) * w_b
+            x = g_all[bounded] - Sigma[bounded, bounded] * w_b
+            with np.errstate(divide='ignore', invalid='ignore'):
+                c1_new = c1 + (u1 - 1) ** 2 / s
+                c3_new = c3 + (um - mu[bounded]) * (u1 - 1) / s
+                c2_last = (mu[bounded] - um) / s
+                c4_last = (1 - u1) / s
+                c = -c1_new * c2_last + c3_new * c4_last
+                l2_new = (l2 - u1 * w_b) + (uv - x) * (u1 - 1) / s
+                l3_last = (x - uv) / s
+                lam = ((1 - (l1 - w_b) + l2_new) * c4_last - c1_new * (w_b + l3_last)) / c
+            lam[(np.abs(c) < tol) | (lam >= lambda_cap) | ~np.isfinite(lam)] = -np.inf
+            if lam.size:
+                j = int(np.argmax(lam))
+                lambda_out, i_out = lam[j], int(bounded[j])
+
+        if lambda_in < 0 and lambda_out < 0:
+            # No more events: the next corner is the minimum-variance portfolio
+            lam_next = 0.0
+        elif lambda_in > lambda_out:
+            lam_next = lambda_in
+            Sigma_inv = _inverse_without(Sigma_inv, free.index(i_in))
+            free.remove(i_in)
+            w[i_in] = bound_in
+        else:
+            lam_next = lambda_out
+            Sigma_inv = _inverse_with(Sigma_inv, Sigma[free, i_out], Sigma[i_out, i_out])
+            free.append(i_out)
+
+        # Solve for the free weights at the new corner
+        bounded = np.setdiff1d(np.arange(n), free)
+        a1, am = Sigma_inv.sum(axis=1), Sigma_inv @ mu[free]
+        l3 = Sigma_inv @ (Sigma[np.ix_(free, bounded)] @ w[bounded])
+        gamma = (-lam_next * am.sum() + 1 - w[bounded].sum() + l3.sum()) / a1.sum()
+        w[free] = -l3 + gamma * a1 + lam_next * am
+
+        corners.append(w.copy())
+        lambdas.append(lam_next)
+        if lam_next == 0:
+            break
+
+    # Drop corners with numerical errors and any that do not lower the return
+    corners, lambdas = np.array(corners), np.array(lambdas)
+    valid = (np.abs(corners.sum(axis=1) - 1) < 1e-7) & np.all(corners >= -1e-7, axis=1) & np.all(corners <= 1 + 1e-7, axis=1)
+    corners, lambdas = corners[valid], lambdas[valid]
+    rets = corners @ mu
+    keep = [0]
+    for k in range(1, len(corners)):
+        if rets[k] < rets[keep[-1]] - tol:
+            keep.append(k)
+    corners, lambdas = np.clip(corners[keep], 0, 1), lambdas[keep]
+    corners /= corners.sum(axis=1, keepdims=True)
+
+    # Guard the end of the frontier: the last corner must be the minimum-variance portfolio
+    w_min = solve_nonneg_qp(Sigma, np.ones(n))
+    if w_min is not None and w_min @ Sigma @ w_min < corners[-1] @ Sigma @ corners[-1] * (1 - 1e-9):
+        if w_min @ mu >= rets[keep[-1]] - tol:
+            corners[-1] = w_min
+        else:
+            corners, lambdas = np.vstack([corners, w_min]), np.append(lambdas, 0.0)
+    return corners, lambdas
+
+def interpolate_frontier(model, corners, n_portfolios=50):
+    """Efficient weights at evenly spaced target returns between the corner portfolios"""
+    corner_returns = corners @ model.mu
+    target_returns = np.linspace(corner_returns[-1], corner_returns[0], n_portfolios)
+    weights = np.column_stack([
+        np.interp(target_returns, corner_returns[::-1], corners[::-1, j])
+        for j in range(model.n_assets)
+    ])
+    return target_returns, weights
+
+def max_sharpe_on_frontier(model, corners):
+    """Exact max-Sharpe portfolio, searched segment by segment along the CLA frontier
+
+    Returns None when no asset beats the risk-free rate, since the tangency
+    portfolio then need not lie on the efficient frontier.
+    """
+    if np.all(model.mu <= model.rf):
+        return None
+    best_weights, best_sharpe = corners[-1], model.sharpe(corners[-1])
+    for w0, w1 in zip(corners[:-1], corners[1:]):
+        # Sharpe along w0 + t (w1 - w0) is (a + b t) / sqrt(c + 2 d t + e t^2)
+        dw = w1 - w0
+        a, b = model.ret(w0) - model.rf, model.mu @ dw
+        Sigma_dw = model.cov_mul(dw)
+        c, d, e = model.variance(w0), w0 @ Sigma_dw, dw @ Sigma_dw
+        candidates = [0.0, 1.0]
+        if abs(b * d - a * e) > 1e-18:
+            t = (a * d - b * c) / (b * d - a * e)
+            if 0 < t < 1:
+                candidates.append(t)
+        for t in candidates:
+            w = w0 + t * dw
+            sharpe = model.sharpe(w)
+            if sharpe > best_sharpe:
+                best_weights, best_sharpe = w, sharpe
+    return best_weights
+
+FRONTIER_WORKERS = int(os.getenv("FRONTIER_WORKERS", "0"))  # processes for SLSQP frontier solves; 0 = in-process
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+def _get_process_pool(name, workers):
+    """Long-lived process pool for one kind of work, or None when workers < 2"""
+    if workers < 2:
+        return None
+    with _process_pools_lock:
+        if name not in _process_pools:
+            _process_pools[name] = ProcessPoolExecutor(max_workers=workers)
+        return _process_pools[name]
+
+def _solve_frontier_targets(model, targets, starts, chain=False):
+    """Minimum-risk weights for each target return (decimal), or None where SLSQP fails
+
+    starts are feasible initial weights; with chain=True each solve starts from the
+    previous solution instead (neighbouring targets have nearby solutions).
+    """
+    n_assets = model.n_assets
+    solutions = []
+    previous = None
+    for target_return, start in zip(targets, starts):
+        result = minimize(
+            lambda w: model.risk(w) * 100,
+            previous if chain and previous is not None else start,
+            jac=lambda w: model.risk_grad(w) * 100,
+            method='SLSQP',
+            bounds=tuple((0, 1) for _ in range(n_assets)),
+            constraints=[_budget_constraint(), _target_return_constraint(model, target_return)],
+            options={'maxiter': max(100, 2 * n_assets)}
+        )
+        previous = result.x if result.success else None
+        solutions.append(previous)
+    return solutions
+
+def _solve_frontier_batches(model, batches, chain):
+    """_solve_frontier_targets over independent (targets, starts) batches, in the pool if there is one"""
+    pool = _get_process_pool('frontier', FRONTIER_WORKERS)
+    if pool is None or len(batches) < 2:
+        return [_solve_frontier_targets(model, targets, starts, chain) for targets, starts in batches]
+    futures = [pool.submit(_solve_frontier_targets, model, targets, starts, chain) for targets, starts in batches]
+    return [future.result() for future in futures]
+
+def _split(items, n_parts):
+    """items in at most n_parts contiguous, non-empty chunks"""
+    bounds = np.linspace(0, len(items), min(n_parts, len(items)) + 1).astype(int)
+    return [items[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+def _frontier_slsqp(model, n_portfolios):
+    """Frontier by solving one SLSQP problem per target return
+
+    The feasible range runs from the minimum-variance portfolio (a non-negative QP)
+    to the highest-return asset, so every target is attainable and each solve can
+    start from a feasible mix of the two ends. Half the points are spread evenly and
+    solved in warm-started segments; the rest bisect the intervals where the curve
+    bends most. Independent segments and bisections go to the process pool.
+    """
+    n_assets = model.n_assets
+    max_sharpe_weights = optimize_portfolio(model, 'sharpe')
+    min_risk_weights = solve_nonneg_qp(model.Sigma, np.ones(n_assets))
+    top = np.zeros(n_assets)
+    top[np.argmax(model.mu)] = 1.0
+    low, high = model.ret(min_risk_weights), model.ret(top)
     
-    for _ in range(1000):
-        weights = np.random.random(n_assets)
-        weights /= np.sum(weights)
-        metrics = calculate_portfolio_metrics(weights, returns_df)
+    points = {low: min_risk_weights}
+    if high - low > 1e-12 and n_portfolios > 1:
+        points[high] = top
+        # Evenly spaced interior targets, starting from the straight line between the ends
+        n_uniform = max(n_portfolios // 2, 2) - 1
+        targets = list(np.linspace(low, high, n_uniform + 1)[1:-1])
+        starts = [min_risk_weights + (t - low) / (high - low) * (top - min_risk_weights) for t in targets]
+        n_segments = max(FRONTIER_WORKERS, 1)
+        batches = list(zip(_split(targets, n_segments), _split(starts, n_segments)))
+        for (segment, _), solutions in zip(batches, _solve_frontier_batches(model, batches, chain=True)):
+            points.update(zip(segment, solutions))
         
-        random_weights.append(weights)
-        random_returns.append(metrics['return'])
-        random_risks.append(metrics['risk'])
-        random_sharpes.append(metrics['sharpe'])
+        while len(points) < n_portfolios:
+            targets = _bisection_targets(model, points, n_portfolios - len(points))
+            if not targets:
+                break
+            starts = [(points[a] + points[b]) / 2 for a, b in targets]
+            targets = [(a + b) / 2 for a, b in targets]
+            n_batches = max(FRONTIER_WORKERS, 1)
+            batches = list(zip(_split(targets, n_batches), _split(starts, n_batches)))
+            for (batch, _), solutions in zip(batches, _solve_frontier_batches(model, batches, chain=False)):
+                # A failed solve stays None, which the chart shows as a gap
+                points.update(zip(batch, solutions))
     
-    # Find optimal portfolios
-    max_sharpe_weights = optimize_portfolio(returns_df, 'sharpe')
-    min_risk_weights = optimize_portfolio(returns_df, 'min_risk')
+    target_returns = sorted(points)
+    frontier_risks = [model.risk(points[t]) * 100 if points[t] is not None else None for t in target_returns]
+    return max_sharpe_weights, min_risk_weights, np.array(target_returns) * 100, frontier_risks
+
+def _bisection_targets(model, points, n_new):
+    """The up to n_new (low, high) return intervals whose midpoints matter most for the chart
+
+    Scores each interval by its length times the turning angle at its ends, in
+    (risk, return) coordinates scaled to the curve's extent. Intervals whose midpoint
+    was already tried and failed are not offered again.
+    """
+    solved = sorted(t for t, w in points.items() if w is not None)
+    if len(solved) < 2:
+        return []
+    xy = np.array([[model.risk(points[t]), t] for t in solved])
+    xy = (xy - xy.min(axis=0)) / np.maximum(np.ptp(xy, axis=0), 1e-12)
+    chords = np.diff(xy, axis=0)
+    lengths = np.hypot(chords[:, 0], chords[:, 1])
+    angles = np.arctan2(chords[:, 1], chords[:, 0])
+    turning = np.zeros(len(solved))
+    turning[1:-1] = np.abs(np.diff(angles))
+    scores = lengths * (1 + turning[:-1] + turning[1:])
+    order = [i for i in np.argsort(scores)[::-1]
+             if solved[i + 1] - solved[i] > 1e-12 and (solved[i] + solved[i + 1]) / 2 not in points]
+    return [(solved[i], solved[i + 1]) for i in order[:n_new]]
+
+def random_portfolio_cloud(model, n_random=None, seed=42, chunk_size=65536):
+    """Return, risk and Sharpe of random long-only portfolios, in bounded-memory chunks"""
+    n_random = min(int(n_random or RANDOM_PORTFOLIOS), MAX_RANDOM_PORTFOLIOS)
+    rng = np.random.RandomState(seed)
+    returns = np.empty(n_random)
+    risks = np.empty(n_random)
+    for start in range(0, n_random, chunk_size):
+        stop = min(start + chunk_size, n_random)
+        weights = rng.random_sample((stop - start, model.n_assets))
+        weights /= weights.sum(axis=1, keepdims=True)
+        returns[start:stop] = weights @ model.mu
+        risks[start:stop] = np.sqrt(model.batch_variance(weights))
+    return returns, risks, (returns - model.rf) / risks
+
+def _thin_cloud(risks, returns, max_points=CLOUD_CHART_POINTS):
+    """Indices of at most max_points cloud portfolios, one per cell of a grid over the cloud
+
+    Keeps the outline of a large cloud, which is what the chart shows, at a bounded size.
+    """
+    if len(risks) <= max_points:
+        return np.arange(len(risks))
+    side = int(np.sqrt(max_points))
+    cells = []
+    for values in (risks, returns):
+        low, span = values.min(), max(np.ptp(values), 1e-12)
+        cells.append(np.minimum(((values - low) / span * side).astype(int), side - 1))
+    return np.unique(cells[0] * side + cells[1], return_index=True)[1]
+
+def _portfolio_summary(weights, model):
+    metrics = calculate_portfolio_metrics(weights, model)
+    return {
+        'weights': [float(w) for w in weights.tolist()],
+        'metrics': {
+            'return': float(metrics['return']),
+            'risk': float(metrics['risk']),
+            'sharpe': float(metrics['sharpe'])
+        }
+    }
+
+def iter_efficient_frontier(model, n_portfolios=50, method='cla', n_random=None):
+    """Yield ('cloud', ...), then ('point', ...) per frontier portfolio, then ('optimal', ...)"""
+    if not isinstance(model, PortfolioModel):
+        model = PortfolioModel(model)
     
-    max_sharpe_metrics = calculate_portfolio_metrics(max_sharpe_weights, returns_df)
-    min_risk_metrics = calculate_portfolio_metrics(min_risk_weights, returns_df)
+    # Generate random portfolios
+    random_returns, random_risks, random_sharpes = random_portfolio_cloud(model, n_random)
+    random_returns, random_risks = random_returns * 100, random_risks * 100
+    keep = _thin_cloud(random_risks, random_returns)
+    random_returns, random_risks, random_sharpes = random_returns[keep], random_risks[keep], random_sharpes[keep]
+    yield 'cloud', {
+        'returns': [float(r) for r in random_returns],
+        'risks': [float(r) for r in random_risks],
+        'sharpes': [float(s) for s in random_sharpes]
+    }
     
-    # Generate frontier curve
-    target_returns = np.linspace(min(random_returns), max(random_returns), n_portfolios)
-    frontier_risks = []
-    frontier_weights = []
+    if method == 'cla':
+        # Whole frontier from one pass of the Critical Line Algorithm
+        corners, _ = critical_line(model)
+        target_returns, frontier_weights = interpolate_frontier(model, corners, n_portfolios)
+        for target_return, weights in zip(target_returns, frontier_weights):
+            yield 'point', {'return': float(target_return * 100), 'risk': float(model.risk(weights) * 100)}
+        max_sharpe_weights = max_sharpe_on_frontier(model, corners)
+        if max_sharpe_weights is None:
+            max_sharpe_weights = optimize_portfolio(model, 'sharpe')
+        min_risk_weights = corners[-1]
+    else:
+        max_sharpe_weights, min_risk_weights, target_returns, frontier_risks = \
+            _frontier_slsqp(model, n_portfolios)
+        for target_return, risk in zip(target_returns, frontier_risks):
+            yield 'point', {'return': float(target_return), 'risk': float(risk) if risk is not None else None}
     
-    for target_return in target_returns:
-        constraints = [
-            {'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-            {'type': 'eq', 'fun': lambda x: calculate_portfolio_metrics(x, returns_df)['return'] - target_return}
-        ]
-        
-        result = minimize(
-            lambda w: calculate_portfolio_metrics(w, returns_df)['risk'],
-            np.array([1/n_assets] * n_assets),
-            method='SLSQP',
-            bounds=tuple((0, 1) for _ in range(n_assets)),
-            constraints=constraints
-        )
-        
-        if result.success:
-            frontier_risks.append(calculate_portfolio_metrics(result.x, returns_df)['risk'])
-            frontier_weights.append(result.x)
+    yield 'optimal', {
+        'max_sharpe': _portfolio_summary(max_sharpe_weights, model),
+        'min_risk': _portfolio_summary(min_risk_weights, model)
+    }
+
+def assemble_frontier(events):
+    """Collect iter_efficient_frontier events into the generate_efficient_frontier dict"""
+    frontier_data = {'frontier': {'returns': [], 'risks': []}}
+    for event, payload in events:
+        if event == 'cloud':
+            frontier_data['random'] = payload
+        elif event == 'point':
+            frontier_data['frontier']['returns'].append(payload['return'])
+            frontier_data['frontier']['risks'].append(payload['risk'])
         else:
-            frontier_risks.append(None)
-            frontier_weights.append(None)
-    
+            frontier_data['optimal'] = payload
+    return frontier_data
+
+def frontier_events(frontier_data):
+    """Replay a generate_efficient_frontier dict as iter_efficient_frontier events"""
+    yield 'cloud', frontier_data['random']
+    for ret, risk in zip(frontier_data['frontier']['returns'], frontier_data['frontier']['risks']):
+        yield 'point', {'return': ret, 'risk': risk}
+    yield 'optimal', frontier_data['optimal']
+
+def generate_efficient_frontier(model, n_portfolios=50, method='cla', n_random=None):
+    """Generate efficient frontier data (exact CLA frontier, or per-point SLSQP)"""
+    return assemble_frontier(iter_efficient_frontier(model, n_portfolios, method, n_random))
+
+# ========== RESULT CACHING ==========
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+# Frontier and optimal portfolios, keyed by (symbol set, data window, data version)
+frontier_cache = LRUCache(maxsize=int(os.getenv("FRONTIER_CACHE_SIZE", "64")))
+
+# Concurrent requests for the same frontier share one computation
+compute_flight = SingleFlight()
+
+def _frontier_key(model):
+    return (tuple(sorted(model.symbols)), model.window, model.version)
+
+def _reorder_optimal(frontier_data, from_symbols, to_symbols):
+    """Permute the optimal-portfolio weights from one symbol order to another"""
+    if list(from_symbols) == list(to_symbols):
+        return frontier_data
+    idx = [list(from_symbols).index(symbol) for symbol in to_symbols]
+    optimal = {
+        name: dict(portfolio, weights=[portfolio['weights'][i] for i in idx])
+        for name, portfolio in frontier_data['optimal'].items()
+    }
+    return dict(frontier_data, optimal=optimal)
+
+def cached_efficient_frontier(model, n_portfolios=50):
+    """generate_efficient_frontier, memoised independently of symbol order and user weights"""
+    key = _frontier_key(model) + (n_portfolios,)
+    canonical = sorted(model.symbols)
+
+    def compute():
+        frontier_data = frontier_cache.get(key)
+        if frontier_data is None:
+            frontier_data = generate_efficient_frontier(model.select(canonical), n_portfolios)
+            frontier_cache.put(key, frontier_data)
+        return frontier_data
+
+    frontier_data = frontier_cache.get(key)
+    if frontier_data is None:
+        frontier_data = compute_flight.do(key, compute)
+    return _reorder_optimal(frontier_data, canonical, model.symbols)
+
+def stream_efficient_frontier(model, n_portfolios=50):
+    """cached_efficient_frontier as events, yielded as each part is ready"""
+    key = _frontier_key(model) + (n_portfolios,)
+    canonical = sorted(model.symbols)
+    frontier_data = frontier_cache.get(key)
+    future, leader = (None, False) if frontier_data is not None else compute_flight.join(key)
+    if not leader:
+        # Cached, or being computed for another request: replay the finished result
+        frontier_data = frontier_data or future.result()
+        yield from frontier_events(_reorder_optimal(frontier_data, canonical, model.symbols))
+        return
+
+    events = iter_efficient_frontier(model.select(canonical), n_portfolios)
+    collected = []
+    try:
+        for event, payload in events:
+            collected.append((event, payload))
+            if event == 'optimal':
+                payload = _reorder_optimal({'optimal': payload}, canonical, model.symbols)['optimal']
+            try:
+                yield event, payload
+            except GeneratorExit:
+                # The client went away; finish anyway for requests waiting on this result
+                collected.extend(events)
+                break
+        frontier_data = assemble_frontier(collected)
+        frontier_cache.put(key, frontier_data)
+    except BaseException as e:
+        compute_flight.finish(key, error=e)
+        raise
+    compute_flight.finish(key, frontier_data)
+
+# ========== STOCK STATISTICS ==========
+def stock_statistics(returns_df, risk_free_rate=RISK_FREE_RATE):
+    """Annual return, volatility, Sharpe, max drawdown and beta of every column in one pass
+
+    Beta is measured against the equal-weighted portfolio of the panel.
+    """
+    returns = returns_df.values
+    annual_return = returns.mean(axis=0) * TRADING_DAYS
+    annual_vol = returns.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+    sharpe = (annual_return - risk_free_rate) / annual_vol
+
+    wealth = np.cumprod(1 + returns, axis=0)
+    max_drawdown = (wealth / np.maximum.accumulate(wealth, axis=0) - 1).min(axis=0)
+
+    market = returns.mean(axis=1)
+    market_centered = market - market.mean()
+    beta = market_centered @ (returns - returns.mean(axis=0)) / (market_centered @ market_centered)
+
+    return {
+        symbol: {
+            'return': float(round(annual_return[i] * 100, 2)),
+            'risk': float(round(annual_vol[i] * 100, 2)),
+            'sharpe': float(round(sharpe[i], 3)),
+            'max_drawdown': float(round(max_drawdown[i] * 100, 2)),
+            'beta': float(round(beta[i], 3))
+        }
+        for i, symbol in enumerate(returns_df.columns)
+    }
+
+class StatisticsTable:
+    """Per-stock statistics for the default window, rebuilt only when the data version changes"""
+
+    def __init__(self):
+        self.current = None  # (version, performance, as_of), swapped atomically
+        self.rebuild_for = None  # last completed session a background rebuild was started for
+        self.lock = threading.Lock()
+
+    def update(self, returns_df):
+        version = returns_version(returns_df)
+        if self.current is None or self.current[0] != version:
+            self.current = (version, stock_statistics(returns_df), last_complete_day())
+        else:
+            self.current = self.current[:2] + (last_complete_day(),)
+        return self.current
+
+    def is_stale(self):
+        """True before the first build, or once a session has closed since the last check"""
+        return self.current is None or self.current[2] < last_complete_day()
+
+    def rebuild_in_background(self):
+        """Reload the data and update the table on a daemon thread, at most once per session"""
+        day = last_complete_day()
+        with self.lock:
+            if self.rebuild_for == day:
+                return
+            self.rebuild_for = day
+
+        def run():
+            try:
+                stock_data, returns_df = prepare_portfolio_data()
+                if not returns_df.empty:
+                    self.update(returns_df)
+            except Exception as e:
+                print(f"Error rebuilding stock statistics: {e}")
+        threading.Thread(target=run, name='stock-stats', daemon=True).start()
+
+stock_stats = StatisticsTable()
+
+# ========== PRECOMPUTED RESULTS ==========
+PRECOMPUTE_MAX_UNIVERSE = int(os.getenv("PRECOMPUTE_MAX_UNIVERSE", "10"))  # enumerate all subsets up to this size
+PRECOMPUTE_TOP_K = int(os.getenv("PRECOMPUTE_TOP_K", "50"))  # otherwise the most-requested subsets
+REFRESH_TIME = os.getenv("REFRESH_TIME", "16:00")  # local time of the end-of-day refresh
+
+# How often each symbol subset has been requested, for choosing what to precompute
+subset_requests = Counter()
+
+class ResultStore:
+    """Strategy results per symbol subset for the default window, replaced wholesale on refresh"""
+
+    def __init__(self):
+        self.results = {}
+        self.universe = None
+        self.refreshed_at = None
+
+    def get(self, symbols):
+        """(model, frontier_data, equal_metrics) in the requested symbol order, or None"""
+        canonical = tuple(sorted(symbols))
+        entry = self.results.get(canonical)
+        if entry is None:
+            return None
+        model = entry['model'].select(symbols)
+        return model, _reorder_optimal(entry['frontier'], canonical, symbols), entry['equal']
+
+    def model(self, symbols):
+        """Slice of the refreshed universe model for symbols, or None if any is outside it"""
+        universe = self.universe
+        if universe is None or not set(symbols) <= set(universe.symbols):
+            return None
+        return universe.select(symbols)
+
+    def replace(self, results, universe=None):
+        self.results = results
+        self.universe = universe
+        self.refreshed_at = datetime.now()
+
+result_store = ResultStore()
+
+def subsets_to_precompute(universe):
+    """Every subset of size >= 2 for small universes, else the top-K requested subsets"""
+    universe = sorted(universe)
+    if len(universe) <= PRECOMPUTE_MAX_UNIVERSE:
+        return [subset for size in range(2, len(universe) + 1) for subset in combinations(universe, size)]
+    return [subset for subset, _ in subset_requests.most_common(PRECOMPUTE_TOP_K)
+            if set(subset) <= set(universe)]
+
+def precompute_results(universe_model):
+    """Frontier, max-Sharpe, min-risk and equal-weight results for every subset to precompute"""
+    started = time.monotonic()
+    results = {}
+    for subset in subsets_to_precompute(universe_model.symbols):
+        model = universe_model.select(list(subset))
+        equal_weights = np.full(model.n_assets, 1 / model.n_assets)
+        results[subset] = {
+            'model': model,
+            'frontier': generate_efficient_frontier(model),
+            'equal': calculate_portfolio_metrics(equal_weights, model)
+        }
+    print(f"Precomputed {len(results)} portfolio subsets in {time.monotonic() - started:.2f}s")
+    return results
+
+# Running moments of the default-window universe, carried across refreshes
+universe_estimator = None
+
+def update_universe_model(returns_df):
+    """Universe model after folding in the return rows added since the last refresh
+
+    Only rows up to last_complete_day() are applied: the estimator never revisits a
+    date it has seen, so a provisional intraday bar would otherwise stick until restart.
+    """
+    global universe_estimator
+    returns_df = returns_df[returns_df.index.normalize() <= pd.Timestamp(last_complete_day())]
+    if returns_df.empty:
+        raise ValueError('No completed trading days to estimate the universe model from')
+    estimator = universe_estimator
+    if (estimator is None or estimator.symbols != list(returns_df.columns)
+            or estimator.start_date != returns_df.index[0] or estimator.last_date not in returns_df.index
+            or estimator.rows_seen != (returns_df.index <= estimator.last_date).sum()):
+        # First refresh, or the history itself changed (including back-filled rows): start over
+        estimator = CovarianceEstimator(returns_df.columns, COVARIANCE_MODE,
+                                        COVARIANCE_LOOKBACK, COVARIANCE_HALFLIFE)
+    applied = estimator.update(returns_df)
+    print(f"Covariance estimator ({estimator.mode}): applied {applied} new rows")
+    universe_estimator = estimator
+    return estimator.to_model()
+
+def refresh_data():
+    """End-of-day refresh: load the universe for the default window and precompute results"""
+    try:
+        stock_data, returns_df = prepare_portfolio_data()
+        if returns_df.empty:
+            print("Refresh skipped: no valid stock data available")
+            return
+        stock_stats.update(returns_df)
+        universe_model = update_universe_model(returns_df)
+        result_store.replace(precompute_results(universe_model), universe_model)
+    except Exception as e:
+        print(f"Error refreshing data: {e}")
+
+def _seconds_until(clock_time):
+    """Seconds from now until the next occurrence of HH:MM local time"""
+    hour, minute = (int(part) for part in clock_time.split(':'))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+def start_refresh_scheduler():
+    """Refresh now, then once a day at REFRESH_TIME, on a daemon thread"""
+    def run():
+        while True:
+            refresh_data()
+            time.sleep(_seconds_until(REFRESH_TIME))
+    thread = threading.Thread(target=run, name='data-refresh', daemon=True)
+    thread.start()
+    return thread
+
+# ========== BACKTESTING ==========
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0"))  # processes for rebalance optimisations; 0 = in-process
+BACKTEST_STRATEGIES = ('equal', 'max_sharpe', 'min_risk', 'custom')
+
+def _strategy_weights(model, strategy, custom_weights=None):
+    """Target weights of a strategy for one estimation window, or None if it fails"""
+    if strategy == 'max_sharpe':
+        return optimize_portfolio(model, 'sharpe')
+    if strategy == 'min_risk':
+        return solve_nonneg_qp(model.Sigma, np.ones(model.n_assets))
+    if strategy == 'custom':
+        return custom_weights
+    return np.full(model.n_assets, 1 / model.n_assets)
+
+def _rebalance_weights(models, strategy, custom_weights=None):
+    return [_strategy_weights(model, strategy, custom_weights) for model in models]
+
+def walk_forward_backtest(returns_df, strategy='max_sharpe', lookback=252, rebalance=21,
+                          cost_bps=10.0, custom_weights=None, estimator='rolling'):
+    """Out-of-sample performance of re-optimising every `rebalance` days on the trailing window
+
+    Moments come from one CovarianceEstimator rolled forward through the panel, so each
+    window costs only its new rows; the per-window optimisations are independent and
+    go to the process pool. Returns are then computed for the whole panel at once,
+    with weights drifting between rebalances and costs charged on turnover.
+    """
+    if strategy not in BACKTEST_STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    if lookback <= returns_df.shape[1]:
+        raise ValueError(f"Lookback must exceed the number of stocks ({returns_df.shape[1]})")
+    if rebalance < 1:
+        raise ValueError('Rebalance interval must be at least 1 day')
+    if len(returns_df) <= lookback:
+        raise ValueError(f"Need more than {lookback} days of returns, got {len(returns_df)}")
+    if strategy == 'custom':
+        custom_weights = np.asarray(custom_weights, dtype=float)
+        if custom_weights.shape != (returns_df.shape[1],) or custom_weights.sum() <= 0:
+            raise ValueError('Custom weights must have one positive-sum entry per stock')
+        custom_weights = custom_weights / custom_weights.sum()
+
+    # Estimates at each rebalance date, from data strictly before it
+    starts = np.arange(lookback, len(returns_df), rebalance)
+    covariance = CovarianceEstimator(returns_df.columns, estimator, lookback, COVARIANCE_HALFLIFE)
+    models = []
+    for start in starts:
+        covariance.update(returns_df.iloc[:start])
+        models.append(covariance.to_model())
+
+    pool = _get_process_pool('backtest', BACKTEST_WORKERS)
+    if pool is None:
+        targets = _rebalance_weights(models, strategy, custom_weights)
+    else:
+        batches = _split(models, BACKTEST_WORKERS)
+        futures = [pool.submit(_rebalance_weights, batch, strategy, custom_weights) for batch in batches]
+        targets = [weights for future in futures for weights in future.result()]
+    # Keep the previous allocation when an optimisation fails or returns non-finite weights
+    equal = np.full(returns_df.shape[1], 1 / returns_df.shape[1])
+    for k, weights in enumerate(targets):
+        if weights is None or not np.all(np.isfinite(weights)):
+            targets[k] = targets[k - 1] if k else equal
+    targets = np.array(targets)
+
+    # Growth of each asset since its period's rebalance, via cumulative log returns
+    returns = returns_df.values[lookback:]
+    period = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(returns_df))))
+    log_growth = np.cumsum(np.log1p(returns), axis=0)
+    period_base = np.vstack([np.zeros(returns.shape[1]), log_growth])[starts - lookback]
+    growth = np.exp(log_growth - period_base[period])
+    previous_growth = np.exp(np.vstack([np.zeros(returns.shape[1]), log_growth[:-1]]) - period_base[period])
+    weights = targets[period]
+    gross = (weights * growth).sum(axis=1) / (weights * previous_growth).sum(axis=1) - 1
+
+    # Turnover from the drifted holdings at the end of each period to the new targets
+    period_end = np.append(starts[1:] - lookback, len(returns)) - 1
+    drifted = targets * growth[period_end]
+    drifted /= drifted.sum(axis=1, keepdims=True)
+    turnover = np.abs(targets - np.vstack([np.zeros(returns.shape[1]), drifted[:-1]])).sum(axis=1)
+    costs = turnover * cost_bps / 1e4
+    net = gross.copy()
+    net[starts - lookback] -= costs
+
+    value = np.cumprod(1 + net)
+    annual_return = net.mean() * TRADING_DAYS
+    annual_vol = net.std(ddof=1) * np.sqrt(TRADING_DAYS)
+    dates = [str(date) for date in returns_df.index[lookback:]]
+    return {
+        'metrics': {
+            'return': float(annual_return * 100),
+            'risk': float(annual_vol * 100),
+            'sharpe': float((annual_return - RISK_FREE_RATE) / annual_vol),
+            'max_drawdown': float((value / np.maximum.accumulate(value) - 1).min() * 100),
+            'total_return': float((value[-1] - 1) * 100),
+            'average_turnover': float(turnover[1:].mean() * 100) if len(turnover) > 1 else 0.0,
+            'total_costs': float(costs.sum() * 100)
+        },
+        'equity_curve': {'dates': dates, 'values': value.tolist()},
+        'rebalances': {
+            'dates': [dates[start - lookback] for start in starts],
+            'weights': targets.tolist(),
+            'turnover': turnover.tolist()
+        }
+    }
+
+# ========== MONTE CARLO SIMULATION ==========
+SIMULATION_WORKERS = int(os.getenv("SIMULATION_WORKERS", "0"))  # processes for path chunks; 0 = in-process
+MAX_SIMULATION_PATHS = 10_000_000
+SIMULATION_PERCENTILES = (5, 25, 50, 75, 95)
+
+def _simulate_chunk(mu, L, weights, horizon_days, n_paths, seed, distribution, dof, checkpoints, edges):
+    """Histogram and moments of log portfolio value at each checkpoint, for one chunk of buy-and-hold paths
+
+    Paths are advanced one day at a time, so memory is O(n_paths * n_assets).
+    """
+    rng = np.random.Generator(np.random.PCG64(seed))
+    growth = np.ones((n_paths, len(weights)))
+    counts = np.zeros((len(checkpoints), len(edges) + 1), dtype=np.int64)
+    moments = np.zeros((len(checkpoints), 3))  # sum, sum of squares, count below zero
+    daily_mu, daily_L = mu / TRADING_DAYS, L / np.sqrt(TRADING_DAYS)
+    checkpoint = 0
+    for day in range(1, horizon_days + 1):
+        shocks = rng.standard_normal((n_paths, len(weights))) @ daily_L.T
+        if distribution == 't':
+            # Multivariate Student-t with unit variance: one chi-square mixing draw per path and day
+            shocks *= np.sqrt((dof - 2) / rng.chisquare(dof, (n_paths, 1)))
+        growth *= 1 + daily_mu + shocks
+        if day == checkpoints[checkpoint]:
+            log_value = np.log(np.maximum(growth @ weights, 1e-300))
+            counts[checkpoint] += np.bincount(np.searchsorted(edges, log_value), minlength=len(edges) + 1)
+            moments[checkpoint] += log_value.sum(), (log_value ** 2).sum(), (log_value < 0).sum()
+            checkpoint += 1
+    return counts, moments
+
+def _histogram_percentiles(counts, edges, percentiles):
+    """Percentiles from bin counts over edges, interpolating linearly within a bin"""
+    cumulative = np.cumsum(counts)
+    # Outermost bins are open-ended: pin them to the grid's ends
+    positions = np.concatenate([[edges[0]], edges, [edges[-1]]])
+    cdf = np.concatenate([[0], cumulative]) / cumulative[-1]
+    return np.interp(np.asarray(percentiles) / 100, cdf, positions)
+
+def _as_finished(pool, fn, tasks, in_flight):
+    """(index, fn(*task)) from the pool in completion order, with at most in_flight submitted at once"""
+    pending = {}
+    for k, task in enumerate(tasks):
+        pending[pool.submit(fn, *task)] = k
+        if len(pending) >= in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    for future, k in pending.items():
+        yield k, future.result()
+
+def simulate_portfolio(model, weights, horizon_days=TRADING_DAYS, n_paths=100_000, distribution='normal',
+                       dof=5, chunk_size=10_000, seed=None, n_bins=4000):
+    """Distribution of buy-and-hold outcomes over horizon_days from correlated daily return paths
+
+    Paths are drawn in chunks from independent SeedSequence streams (so results do not
+    depend on how chunks are spread over processes) and summarised into fixed-grid
+    histograms of log value, from which percentiles are read; no chunk is kept.
+    """
+    if distribution not in ('normal', 't'):
+        raise ValueError(f"Unknown distribution: {distribution}")
+    if distribution == 't' and dof <= 2:
+        raise ValueError('Student-t degrees of freedom must exceed 2')
+    if int(horizon_days) < 1:
+        raise ValueError('Horizon must be at least 1 day')
+    if int(n_paths) < 1:
+        raise ValueError('Number of paths must be at least 1')
+    weights = np.asarray(weights, dtype=float)
+    n_paths = min(int(n_paths), MAX_SIMULATION_PATHS)
+    horizon_days = int(horizon_days)
+    checkpoints = np.unique(np.linspace(0, horizon_days, 21)[1:].round().astype(int))
+    checkpoints = checkpoints[checkpoints > 0]
+
+    # Log-value grid wide enough for the horizon: drift +/- 12 standard deviations
+    years = horizon_days / TRADING_DAYS
+    spread = max(model.risk(weights) * np.sqrt(years), 1e-4)
+    centre = (model.ret(weights) - model.risk(weights) ** 2 / 2) * years
+    edges = np.linspace(centre - 12 * spread, centre + 12 * spread, n_bins + 1)
+
+    sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = ((model.mu, model.L, weights, horizon_days, size, child, distribution, dof, checkpoints, edges)
+             for size, child in zip(sizes, seeds))
+    pool = _get_process_pool('simulation', SIMULATION_WORKERS)
+    if pool is None:
+        chunks = enumerate(_simulate_chunk(*task) for task in tasks)
+    else:
+        chunks = _as_finished(pool, _simulate_chunk, tasks, 2 * SIMULATION_WORKERS)
+    # Fold histograms in as they arrive; the small moment sums are added in chunk order,
+    # so floating-point rounding does not depend on which chunk finished first
+    counts = np.zeros((len(checkpoints), n_bins + 2), dtype=np.int64)
+    chunk_moments = np.zeros((len(sizes), len(checkpoints), 3))
+    for k, (chunk_counts, moments) in chunks:
+        counts += chunk_counts
+        chunk_moments[k] = moments
+    moments = chunk_moments.sum(axis=0)
+
+    def to_percent(log_values):
+        return [float(value) for value in (np.exp(log_values) - 1) * 100]
+
+    terminal = counts[-1]
+    terminal_percentiles = _histogram_percentiles(terminal, edges, SIMULATION_PERCENTILES)
+    # Expected shortfall: mean outcome in the worst 5% of paths, from bin midpoints
+    midpoints = np.concatenate([[edges[0]], (edges[:-1] + edges[1:]) / 2, [edges[-1]]])
+    tail = np.minimum(np.cumsum(terminal), 0.05 * n_paths)
+    tail_counts = np.diff(np.concatenate([[0], tail]))
+    log_mean = moments[-1, 0] / n_paths
     return {
-        'random': {
-            'returns': [float(r) for r in random_returns],
-            'risks': [float(r) for r in random_risks],
-            'sharpes': [float(s) for s in random_sharpes]
+        'paths': n_paths,
+        'horizon_days': horizon_days,
+        'distribution': distribution,
+        'terminal': {
+            'percentiles': dict(zip(map(str, SIMULATION_PERCENTILES), to_percent(terminal_percentiles))),
+            'log_mean': float(log_mean),
+            'log_std': float(np.sqrt(max(moments[-1, 1] / n_paths - log_mean ** 2, 0))),
+            'probability_of_loss': float(moments[-1, 2] / n_paths),
+            'expected_shortfall_95': -float((np.exp(midpoints) - 1) @ tail_counts / tail_counts.sum() * 100)
         },
+        'fan': {
+            'days': checkpoints.tolist(),
+            'percentiles': {
+                str(p): to_percent([_histogram_percentiles(row, edges, [p])[0] for row in counts])
+                for p in SIMULATION_PERCENTILES
+            }
+        }
+    }
+
+# ========== RESAMPLED FRONTIER ==========
+RESAMPLE_WORKERS = int(os.getenv("RESAMPLE_WORKERS", "0"))  # processes for bootstrap frontiers; 0 = in-process
+MAX_BOOTSTRAPS = 5000
+
+# Worker-side attachment to the shared returns panel of the current request
+_shared_panel = {'name': None, 'block': None, 'array': None}
+
+def _attach_shared_panel(name, shape):
+    """The shared returns panel as an ndarray, attaching on first use in this process"""
+    if _shared_panel['name'] != name:
+        if _shared_panel['block'] is not None:
+            _shared_panel['block'].close()
+        block = shared_memory.SharedMemory(name=name)
+        _shared_panel.update(name=name, block=block, array=np.ndarray(shape, dtype=np.float64, buffer=block.buf))
+    return _shared_panel['array']
+
+def _bootstrap_frontiers(panel, seeds, n_portfolios, risk_free_rate):
+    """Summed rank-matched frontier weights and max-Sharpe weights over one batch of bootstraps"""
+    if isinstance(panel, tuple):
+        panel = _attach_shared_panel(*panel)
+    n_days, n_assets = panel.shape
+    symbols = list(range(n_assets))
+    frontier_sum = np.zeros((n_portfolios, n_assets))
+    max_sharpe_sum = np.zeros(n_assets)
+    for seed in seeds:
+        sample = panel[np.random.default_rng(seed).integers(0, n_days, n_days)]
+        model = PortfolioModel.from_moments(
+            symbols, sample.mean(axis=0) * TRADING_DAYS, np.cov(sample, rowvar=False) * TRADING_DAYS,
+            risk_free_rate=risk_free_rate
+        )
+        corners, _ = critical_line(model)
+        frontier_sum += interpolate_frontier(model, corners, n_portfolios)[1]
+        max_sharpe_weights = max_sharpe_on_frontier(model, corners)
+        max_sharpe_sum += max_sharpe_weights if max_sharpe_weights is not None else corners[-1]
+    return frontier_sum, max_sharpe_sum
+
+def resampled_frontier(returns_df, n_bootstraps=100, n_portfolios=50, seed=None, risk_free_rate=RISK_FREE_RATE):
+    """Michaud resampled frontier: rank-averaged CLA frontiers of bootstrapped returns panels
+
+    Each bootstrap redraws the panel's days with replacement and solves its frontier
+    with the CLA; the i-th portfolios of all bootstraps are averaged and evaluated on
+    the full-sample estimates. With RESAMPLE_WORKERS >= 2 the bootstraps are spread
+    over a persistent process pool that reads the panel from shared memory.
+    """
+    n_bootstraps = min(int(n_bootstraps), MAX_BOOTSTRAPS)
+    panel = np.ascontiguousarray(returns_df.values, dtype=np.float64)
+    seeds = np.random.SeedSequence(seed).spawn(n_bootstraps)
+    pool = _get_process_pool('resample', RESAMPLE_WORKERS)
+    if pool is None:
+        frontier_sum, max_sharpe_sum = _bootstrap_frontiers(panel, seeds, n_portfolios, risk_free_rate)
+    else:
+        block = shared_memory.SharedMemory(create=True, size=panel.nbytes)
+        try:
+            np.ndarray(panel.shape, dtype=np.float64, buffer=block.buf)[:] = panel
+            batches = _split(seeds, 4 * RESAMPLE_WORKERS)
+            futures = [pool.submit(_bootstrap_frontiers, (block.name, panel.shape), batch, n_portfolios, risk_free_rate)
+                       for batch in batches]
+            results = [future.result() for future in futures]
+        finally:
+            block.close()
+            block.unlink()
+        frontier_sum = sum(result[0] for result in results)
+        max_sharpe_sum = sum(result[1] for result in results)
+
+    model = PortfolioModel(returns_df, risk_free_rate)
+    frontier_weights = frontier_sum / n_bootstraps
+    max_sharpe_weights = max_sharpe_sum / n_bootstraps
+    return {
+        'bootstraps': n_bootstraps,
         'frontier': {
-            'returns': [float(r) for r in target_returns],
-            'risks': [float(r) if r is not None else None for r in frontier_risks]
+            'returns': [model.ret(w) * 100 for w in frontier_weights],
+            'risks': [model.risk(w) * 100 for w in frontier_weights],
+            'weights': frontier_weights.tolist()
         },
-        'optimal': {
-            'max_sharpe': {
-                'weights': [float(w) for w in max_sharpe_weights.tolist()],
-                'metrics': {
-                    'return': float(max_sharpe_metrics['return']),
-                    'risk': float(max_sharpe_metrics['risk']),
-                    'sharpe': float(max_sharpe_metrics['sharpe'])
+        'optimal': {'max_sharpe': _portfolio_summary(max_sharpe_weights, model)}
+    }
+
+# ========== ANALYSIS ==========
+ANALYSIS_STAGES = ('data', 'frontier', 'charts')
+
+def parse_analysis_request(data):
+    """(stocks, custom weights, optimization, from_date, to_date) from an /analyze payload"""
+    selected_stocks = data.get('stocks', list(STOCKS.keys()))
+    from_date = datetime.fromisoformat(data['from_date']) if data.get('from_date') else None
+    to_date = datetime.fromisoformat(data['to_date']) if data.get('to_date') else None
+    # Validate selected stocks
+    if len(selected_stocks) < 2:
+        raise ValueError('At least 2 stocks must be selected')
+    return selected_stocks, data.get('weights', {}), data.get('optimization', 'equal'), from_date, to_date
+
+def load_analysis_model(selected_stocks, from_date=None, to_date=None, record=False):
+    """(model, frontier_data, equal_metrics); the last two are None unless precomputed
+
+    record=True counts the subset towards what the refresh precomputes (analysis requests only).
+    """
+    if record:
+        subset_requests[tuple(sorted(selected_stocks))] += 1
+    # Serve precomputed results for the default window, else compute live
+    if from_date is None and to_date is None:
+        precomputed = result_store.get(selected_stocks)
+        if precomputed is not None:
+            return precomputed
+        # Any other subset of the universe is a slice of its mean and covariance
+        model = result_store.model(selected_stocks)
+        if model is not None:
+            return model, None, None
+
+    # Fetch and align only the selected stocks
+    print("Fetching stock data...")
+    stock_data, returns_df = prepare_portfolio_data(selected_stocks, from_date, to_date)
+    if returns_df.empty:
+        raise ValueError('No valid stock data available')
+    missing = [stock for stock in selected_stocks if stock not in returns_df.columns]
+    if missing:
+        raise ValueError(f"No data available for: {', '.join(missing)}")
+    return build_portfolio_model(returns_df), None, None
+
+def run_analysis(data, progress=None):
+    """Analyze a portfolio request; returns the JSON-ready response dict
+
+    progress(stage, fraction) is called as each stage in ANALYSIS_STAGES starts and ends.
+    """
+    progress = progress or (lambda stage, fraction: None)
+    try:
+        selected_stocks, weights_input, optimization, from_date, to_date = parse_analysis_request(data)
+        progress('data', 0.0)
+        model, frontier_data, equal_metrics = load_analysis_model(selected_stocks, from_date, to_date, record=True)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    progress('data', 1.0)
+
+    # Efficient frontier and optimal portfolios do not depend on the user's weights
+    progress('frontier', 0.0)
+    if frontier_data is None:
+        frontier_data = cached_efficient_frontier(model)
+    progress('frontier', 1.0)
+
+    progress('charts', 0.0)
+    response = build_analysis_response(
+        selected_stocks, weights_input, optimization, model, frontier_data, equal_metrics
+    )
+    progress('charts', 1.0)
+    return response
+
+def portfolio_weights(selected_stocks, weights_input, optimization, frontier_data=None):
+    """Weights of the requested strategy; frontier_data is only needed for max_sharpe/min_risk"""
+    # Determine weights based on optimization type
+    if optimization == 'max_sharpe':
+        weights = np.array(frontier_data['optimal']['max_sharpe']['weights'])
+    elif optimization == 'min_risk':
+        weights = np.array(frontier_data['optimal']['min_risk']['weights'])
+    elif optimization == 'custom':
+        weights = np.array([weights_input.get(stock, 0) for stock in selected_stocks])
+        if np.sum(weights) == 0:
+            raise ValueError('Custom weights must sum to a positive value')
+        weights = weights / np.sum(weights)  # Normalize
+    else:  # equal
+        weights = np.array([1/len(selected_stocks)] * len(selected_stocks))
+
+    # Check if optimization succeeded
+    if weights is None:
+        raise ValueError('Optimization failed or invalid optimization type')
+    return weights
+
+def build_analysis_response(selected_stocks, weights_input, optimization, model, frontier_data, equal_metrics=None):
+    """Portfolio weights, metrics and charts for one request, given the frontier results"""
+    try:
+        weights = portfolio_weights(selected_stocks, weights_input, optimization, frontier_data)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+
+    # Calculate portfolio metrics
+    if optimization == 'equal' and equal_metrics is not None:
+        metrics = equal_metrics
+    else:
+        metrics = calculate_portfolio_metrics(weights, model)
+    metrics = {
+        'return': float(metrics['return']),
+        'risk': float(metrics['risk']),
+        'sharpe': float(metrics['sharpe'])
+    }
+
+    # Create portfolio allocation chart
+    allocation_chart = {
+        'data': [{
+            'type': 'pie',
+            'labels': selected_stocks,
+            'values': [float(w * 100) for w in weights],  # Convert to float
+            'hole': 0.4,
+            'textinfo': 'label+percent',
+            'textposition': 'outside'
+        }],
+        'layout': {
+            'title': 'Portfolio Allocation',
+            'height': 400
+        }
+    }
+
+    # Create efficient frontier chart
+    frontier_chart = {
+        'data': [
+            {
+                'type': 'scatter',
+                'x': [float(x) for x in frontier_data['random']['risks']],
+                'y': [float(y) for y in frontier_data['random']['returns']],
+                'mode': 'markers',
+                'name': 'Random Portfolios',
+                'marker': {
+                    'size': 5,
+                    'color': [float(c) for c in frontier_data['random']['sharpes']],
+                    'colorscale': 'Viridis',
+                    'showscale': True,
+                    'colorbar': {'title': 'Sharpe Ratio'}
                 }
             },
-            'min_risk': {
-                'weights': [float(w) for w in min_risk_weights.tolist()],
-                'metrics': {
-                    'return': float(min_risk_metrics['return']),
-                    'risk': float(min_risk_metrics['risk']),
-                    'sharpe': float(min_risk_metrics['sharpe'])
-                }
+            {
+                'type': 'scatter',
+                'x': [float(x) if x is not None else None for x in frontier_data['frontier']['risks']],
+                'y': [float(y) for y in frontier_data['frontier']['returns']],
+                'mode': 'lines',
+                'name': 'Efficient Frontier',
+                'line': {'color': 'red', 'width': 3}
+            },
+            {
+                'type': 'scatter',
+                'x': [float(frontier_data['optimal']['max_sharpe']['metrics']['risk'])],
+                'y': [float(frontier_data['optimal']['max_sharpe']['metrics']['return'])],
+                'mode': 'markers',
+                'name': 'Max Sharpe',
+                'marker': {'size': 15, 'color': 'red', 'symbol': 'star'}
+            },
+            {
+                'type': 'scatter',
+                'x': [float(frontier_data['optimal']['min_risk']['metrics']['risk'])],
+                'y': [float(frontier_data['optimal']['min_risk']['metrics']['return'])],
+                'mode': 'markers',
+                'name': 'Min Risk',
+                'marker': {'size': 15, 'color': 'green', 'symbol': 'star'}
+            },
+            {
+                'type': 'scatter',
+                'x': [float(metrics['risk'])],
+                'y': [float(metrics['return'])],
+                'mode': 'markers',
+                'name': 'Your Portfolio',
+                'marker': {'size': 15, 'color': 'blue', 'symbol': 'diamond'}
             }
+        ],
+        'layout': {
+            'title': 'Efficient Frontier Analysis',
+            'xaxis': {'title': 'Risk (Annual Volatility %)'},
+            'yaxis': {'title': 'Return (Annual %)'},
+            'height': 500,
+            'hovermode': 'closest'
+        }
+    }
+
+    # Prepare response
+    response = {
+        'success': True,
+        'portfolio': {
+            'weights': {stock: float(weight) for stock, weight in zip(selected_stocks, weights.tolist())},
+            'metrics': metrics
+        },
+        'optimal': frontier_data['optimal'],
+        'charts': {
+            'allocation': allocation_chart,
+            'frontier': frontier_chart
         }
     }
 
+    return response
+
+# ========== ANALYSIS JOBS ==========
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))  # seconds without a heartbeat before another process takes a job over
+
+class JobStore:
+    """SQLite-backed job records, so queued and finished jobs survive restarts
+
+    Each job records the process that owns it, and that process renews a lease on the
+    job's `updated` time while it lives. After a restart or crash, exactly one live
+    process takes over the jobs whose lease has run out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.initialised = False
+        self._owner = (None, None)
+
+    @property
+    def owner(self):
+        """'<pid>:<token>', new in every process (including forked workers)"""
+        pid, owner = self._owner
+        if pid != os.getpid():
+            owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._owner = (os.getpid(), owner)
+        return owner
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        if not self.initialised:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, key TEXT, status TEXT, payload TEXT, "
+                "progress TEXT, result TEXT, error TEXT, created REAL, updated REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+            try:
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            except sqlite3.OperationalError:
+                pass  # already there
+            self.initialised = True
+        return connection
+
+    def create(self, kind, key, payload):
+        """Insert a queued job, or return the id of an identical queued/running one"""
+        with self.lock, closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,)
+            ).fetchone()
+            if row is not None:
+                return row['id'], False
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            connection.execute(
+                "INSERT INTO jobs (id, kind, key, status, payload, progress, owner, created, updated) "
+                "VALUES (?, ?, ?, 'queued', ?, '{}', ?, ?, ?)",
+                (job_id, kind, key, json.dumps(payload), self.owner, now, now)
+            )
+            return job_id, True
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self.lock, closing(self._connect()) as connection, connection:
+            connection.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self.lock, closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def heartbeat(self):
+        """Renew the lease on this process's queued and running jobs"""
+        with self.lock, closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE jobs SET updated = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time(), self.owner)
+            )
+
+    def claim_orphans(self):
+        """Take over queued/running jobs whose owner's lease has expired; returns the claimed jobs"""
+        current = self.owner
+        claimed = []
+        with self.lock, closing(self._connect()) as connection, connection:
+            rows = connection.execute(
+                "SELECT id, kind, payload, owner FROM jobs WHERE status IN ('queued', 'running') "
+                "AND (owner IS NULL OR (owner != ? AND updated < ?)) ORDER BY created",
+                (current, time.time() - JOB_LEASE)
+            ).fetchall()
+            for row in rows:
+                # Compare-and-set, so only one of several restarted workers wins each job
+                cursor = connection.execute(
+                    "UPDATE jobs SET owner = ?, status = 'queued', updated = ? WHERE id = ? AND owner IS ?",
+                    (current, time.time(), row['id'], row['owner'])
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(dict(row))
+        return claimed
+
+class JobManager:
+    """Runs analysis jobs on a bounded worker pool and records their progress"""
+
+    runners = {'analyze': run_analysis}
+
+    def __init__(self, store, max_workers=2):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.heartbeat_thread = None
+
+    @staticmethod
+    def job_key(kind, payload):
+        return hashlib.sha1(json.dumps([kind, payload], sort_keys=True).encode()).hexdigest()
+
+    def submit(self, kind, payload):
+        """Queue a job; identical in-flight jobs are shared. Returns (job_id, created)"""
+        job_id, created = self.store.create(kind, self.job_key(kind, payload), payload)
+        if created:
+            self.executor.submit(self._run, job_id, kind, payload)
+        return job_id, created
+
+    def resume(self):
+        """Keep this process's job leases alive and requeue expired ones, on a daemon thread"""
+        def run():
+            while True:
+                try:
+                    self.store.heartbeat()
+                    for job in self.store.claim_orphans():
+                        self.executor.submit(self._run, job['id'], job['kind'], json.loads(job['payload']))
+                except Exception as e:
+                    print(f"Error renewing job leases: {e}")
+                time.sleep(JOB_LEASE / 3)
+        if self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(target=run, name='job-heartbeat', daemon=True)
+            self.heartbeat_thread.start()
+        return self.heartbeat_thread
+
+    def _run(self, job_id, kind, payload):
+        stages = {stage: 0.0 for stage in ANALYSIS_STAGES}
+        self.store.update(job_id, status='running', progress=json.dumps(stages))
+
+        def progress(stage, fraction):
+            stages[stage] = fraction
+            self.store.update(job_id, progress=json.dumps(stages))
+
+        try:
+            result = self.runners[kind](payload, progress)
+            if result.get('success'):
+                self.store.update(job_id, status='done', result=json.dumps(result))
+            else:
+                self.store.update(job_id, status='failed', error=result.get('error'))
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=str(e))
+
+job_manager = JobManager(JobStore(JOBS_DB), max_workers=int(os.getenv("JOB_WORKERS", "2")))
+
 # ========== WEB ROUTES ==========
+_background_started = set()
+_background_lock = threading.Lock()
+
+@app.before_request
+def start_background_tasks():
+    """Start this process's background work on its first request, under any server
+
+    A task that fails to start is logged and retried on the next request, without
+    failing this one.
+    """
+    tasks = {'refresh': start_refresh_scheduler, 'jobs': job_manager.resume}
+    if len(_background_started) == len(tasks):
+        return
+    with _background_lock:
+        for name, start in tasks.items():
+            if name in _background_started:
+                continue
+            try:
+                start()
+                _background_started.add(name)
+            except Exception as e:
+                print(f"Error starting background task {name}: {e}")
+
 @app.route('/')
 def index():
     """Main page"""
@@ -237,170 +2371,221 @@ def index():
 def analyze_portfolio():
     """Analyze portfolio based on user inputs"""
     try:
-        data = request.json
-        selected_stocks = data.get('stocks', list(STOCKS.keys()))
-        weights_input = data.get('weights', {})
-        optimization = data.get('optimization', 'equal')
+        return jsonify(run_analysis(request.json))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
 
-        # Validate selected stocks
-        if len(selected_stocks) < 2:
-            return jsonify({'success': False, 'error': 'At least 2 stocks must be selected'})
+def sse_event(event, payload):
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-        # Fetch and prepare data
-        print("Fetching stock data...")
-        stock_data, returns_df = prepare_portfolio_data()
-        if returns_df.empty:
-            return jsonify({'success': False, 'error': 'No valid stock data available'})
-
-        # Filter selected stocks
-        returns_df = returns_df[selected_stocks]
-
-        # Determine weights based on optimization type
-        if optimization == 'max_sharpe':
-            weights = optimize_portfolio(returns_df, 'sharpe')
-        elif optimization == 'min_risk':
-            weights = optimize_portfolio(returns_df, 'min_risk')
-        elif optimization == 'custom':
-            weights = np.array([weights_input.get(stock, 0) for stock in selected_stocks])
-            if np.sum(weights) == 0:
-                return jsonify({'success': False, 'error': 'Custom weights must sum to a positive value'})
-            weights = weights / np.sum(weights)  # Normalize
-        else:  # equal
-            weights = np.array([1/len(selected_stocks)] * len(selected_stocks))
-
-        # Check if optimization succeeded
-        if weights is None:
-            return jsonify({'success': False, 'error': 'Optimization failed or invalid optimization type'})
-
-        # Calculate portfolio metrics
-        metrics = calculate_portfolio_metrics(weights, returns_df)
-        metrics = {
-            'return': float(metrics['return']),
-            'risk': float(metrics['risk']),
-            'sharpe': float(metrics['sharpe'])
-        }
+@app.route('/analyze/stream', methods=['GET'])
+def stream_analysis():
+    """Analyze as Server-Sent Events: cloud, frontier points, optimal portfolios, then the result
 
-        # Generate efficient frontier
-        frontier_data = generate_efficient_frontier(returns_df)
-
-        # Create portfolio allocation chart
-        allocation_chart = {
-            'data': [{
-                'type': 'pie',
-                'labels': selected_stocks,
-                'values': [float(w * 100) for w in weights],  # Convert to float
-                'hole': 0.4,
-                'textinfo': 'label+percent',
-                'textposition': 'outside'
-            }],
-            'layout': {
-                'title': 'Portfolio Allocation',
-                'height': 400
-            }
-        }
+    Query parameters mirror the /analyze payload: stocks (comma separated), optimization,
+    weights (JSON object), from_date and to_date.
+    """
+    data = {key: request.args[key] for key in ('optimization', 'from_date', 'to_date') if key in request.args}
+    if request.args.get('stocks'):
+        data['stocks'] = request.args['stocks'].split(',')
+    if request.args.get('weights'):
+        data['weights'] = json.loads(request.args['weights'])
 
-        # Create efficient frontier chart
-        frontier_chart = {
-            'data': [
-                {
-                    'type': 'scatter',
-                    'x': [float(x) for x in frontier_data['random']['risks']],
-                    'y': [float(y) for y in frontier_data['random']['returns']],
-                    'mode': 'markers',
-                    'name': 'Random Portfolios',
-                    'marker': {
-                        'size': 5,
-                        'color': [float(c) for c in frontier_data['random']['sharpes']],
-                        'colorscale': 'Viridis',
-                        'showscale': True,
-                        'colorbar': {'title': 'Sharpe Ratio'}
-                    }
-                },
-                {
-                    'type': 'scatter',
-                    'x': [float(x) if x is not None else None for x in frontier_data['frontier']['risks']],
-                    'y': [float(y) for y in frontier_data['frontier']['returns']],
-                    'mode': 'lines',
-                    'name': 'Efficient Frontier',
-                    'line': {'color': 'red', 'width': 3}
-                },
-                {
-                    'type': 'scatter',
-                    'x': [float(frontier_data['optimal']['max_sharpe']['metrics']['risk'])],
-                    'y': [float(frontier_data['optimal']['max_sharpe']['metrics']['return'])],
-                    'mode': 'markers',
-                    'name': 'Max Sharpe',
-                    'marker': {'size': 15, 'color': 'red', 'symbol': 'star'}
-                },
-                {
-                    'type': 'scatter',
-                    'x': [float(frontier_data['optimal']['min_risk']['metrics']['risk'])],
-                    'y': [float(frontier_data['optimal']['min_risk']['metrics']['return'])],
-                    'mode': 'markers',
-                    'name': 'Min Risk',
-                    'marker': {'size': 15, 'color': 'green', 'symbol': 'star'}
-                },
-                {
-                    'type': 'scatter',
-                    'x': [float(metrics['risk'])],
-                    'y': [float(metrics['return'])],
-                    'mode': 'markers',
-                    'name': 'Your Portfolio',
-                    'marker': {'size': 15, 'color': 'blue', 'symbol': 'diamond'}
-                }
-            ],
-            'layout': {
-                'title': 'Efficient Frontier Analysis',
-                'xaxis': {'title': 'Risk (Annual Volatility %)'},
-                'yaxis': {'title': 'Return (Annual %)'},
-                'height': 500,
-                'hovermode': 'closest'
-            }
-        }
+    def generate():
+        try:
+            selected_stocks, weights_input, optimization, from_date, to_date = parse_analysis_request(data)
+            model, frontier_data, equal_metrics = load_analysis_model(selected_stocks, from_date, to_date, record=True)
+            yield sse_event('data', {'symbols': model.symbols, 'window': list(model.window)})
 
-        # Prepare response
-        response = {
-            'success': True,
-            'portfolio': {
-                'weights': {stock: float(weight) for stock, weight in zip(selected_stocks, weights.tolist())},
-                'metrics': metrics
-            },
-            'optimal': frontier_data['optimal'],
-            'charts': {
-                'allocation': allocation_chart,
-                'frontier': frontier_chart
-            }
-        }
+            events = frontier_events(frontier_data) if frontier_data else stream_efficient_frontier(model)
+            collected = []
+            for event, payload in events:
+                collected.append((event, payload))
+                yield sse_event(event, payload)
+
+            response = build_analysis_response(
+                selected_stocks, weights_input, optimization, model, assemble_frontier(collected), equal_metrics
+            )
+            if response['success']:
+                # The client already has the frontier chart's data
+                response['charts'].pop('frontier')
+            yield sse_event('result', response)
+        except Exception as e:
+            yield sse_event('result', {'success': False, 'error': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+EVALUATE_CHUNK_ROWS = int(os.getenv("EVALUATE_CHUNK_ROWS", "4096"))
+EVALUATE_STREAM_ROWS = int(os.getenv("EVALUATE_STREAM_ROWS", "10000"))  # stream NDJSON above this
 
-        return jsonify(response)
+def _json_values(values):
+    """ndarray as nested lists with NaN/inf as None"""
+    return np.where(np.isfinite(values), values, None).tolist()
 
+@app.route('/evaluate/batch', methods=['POST'])
+def evaluate_batch():
+    """Return, risk, Sharpe, VaR and risk contributions for many weight vectors at once
+
+    JSON body: {"stocks": [...], "weights": [[...], ...], "from_date", "to_date",
+    "confidence", "horizon_days"}. For large batches, POST the weights as raw
+    little-endian float64 rows (application/octet-stream) with the other fields as
+    query parameters. Batches above EVALUATE_STREAM_ROWS, or requests that accept
+    application/x-ndjson, get one JSON line per portfolio as it is evaluated.
+    """
+    try:
+        if request.mimetype == 'application/octet-stream':
+            options = request.args.to_dict()
+            stocks = options.get('stocks', '').split(',') if options.get('stocks') else list(STOCKS)
+            body = request.get_data()
+            if len(body) % (8 * len(stocks)):
+                raise ValueError(f"Body is not a whole number of {len(stocks)}-asset float64 rows")
+            weights = np.frombuffer(body, dtype='<f8').reshape(-1, len(stocks))
+        else:
+            options = request.json
+            stocks = options.get('stocks', list(STOCKS))
+            weights = np.atleast_2d(np.asarray(options.get('weights', []), dtype=float))
+            if weights.shape[1] != len(stocks):
+                raise ValueError(f"Each weight vector must have {len(stocks)} entries")
+        confidence = float(options.get('confidence', 0.95))
+        horizon_days = float(options.get('horizon_days', 1))
+        from_date = datetime.fromisoformat(options['from_date']) if options.get('from_date') else None
+        to_date = datetime.fromisoformat(options['to_date']) if options.get('to_date') else None
+        model = load_analysis_model(stocks, from_date, to_date)[0]
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+    def evaluated_chunks():
+        for start in range(0, len(weights), EVALUATE_CHUNK_ROWS):
+            yield start, evaluate_portfolios(model, weights[start:start + EVALUATE_CHUNK_ROWS], confidence, horizon_days)
+
+    if len(weights) > EVALUATE_STREAM_ROWS or request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for start, metrics in evaluated_chunks():
+                columns = {name: _json_values(values) for name, values in metrics.items()}
+                for i in range(len(columns['return'])):
+                    row = {name: values[i] for name, values in columns.items()}
+                    yield json.dumps(dict(row, index=start + i)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    chunks = [metrics for _, metrics in evaluated_chunks()]
+    results = {
+        name: _json_values(np.concatenate([chunk[name] for chunk in chunks])) if chunks else []
+        for name in ('return', 'risk', 'sharpe', 'var', 'risk_contributions')
+    }
+    return jsonify({'success': True, 'symbols': model.symbols, 'results': results})
+
+@app.route('/backtest', methods=['POST'])
+def backtest():
+    """Walk-forward backtest of one strategy on the selected stocks"""
+    try:
+        data = request.json
+        selected_stocks, weights_input, strategy, from_date, to_date = parse_analysis_request(data)
+        strategy = data.get('strategy', strategy)
+        stock_data, returns_df = prepare_portfolio_data(selected_stocks, from_date, to_date)
+        missing = [stock for stock in selected_stocks if stock not in returns_df.columns]
+        if returns_df.empty or missing:
+            return jsonify({'success': False, 'error': f"No data available for: {', '.join(missing or selected_stocks)}"})
+        result = walk_forward_backtest(
+            returns_df, strategy,
+            lookback=int(data.get('lookback', 252)),
+            rebalance=int(data.get('rebalance', 21)),
+            cost_bps=float(data.get('cost_bps', 10)),
+            custom_weights=[weights_input.get(stock, 0) for stock in selected_stocks],
+            estimator=data.get('estimator', 'rolling')
+        )
+        return jsonify(dict(result, success=True, symbols=selected_stocks))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/simulate', methods=['POST'])
+def simulate():
+    """Monte Carlo outcome distribution of the portfolio /analyze would choose"""
+    try:
+        data = request.json
+        selected_stocks, weights_input, optimization, from_date, to_date = parse_analysis_request(data)
+        model, frontier_data, equal_metrics = load_analysis_model(selected_stocks, from_date, to_date)
+        if optimization in ('max_sharpe', 'min_risk') and frontier_data is None:
+            frontier_data = cached_efficient_frontier(model)
+        weights = portfolio_weights(selected_stocks, weights_input, optimization, frontier_data)
+        result = simulate_portfolio(
+            model, weights,
+            horizon_days=int(data.get('horizon_days', TRADING_DAYS)),
+            n_paths=int(data.get('paths', 100_000)),
+            distribution=data.get('distribution', 'normal'),
+            dof=float(data.get('dof', 5)),
+            seed=data.get('seed')
+        )
+        return jsonify(dict(result, success=True,
+                            weights={stock: float(w) for stock, w in zip(selected_stocks, weights)}))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/frontier/resampled', methods=['POST'])
+def get_resampled_frontier():
+    """Resampled efficient frontier and max-Sharpe portfolio, next to the sample frontier"""
+    try:
+        data = request.json
+        selected_stocks, weights_input, optimization, from_date, to_date = parse_analysis_request(data)
+        stock_data, returns_df = prepare_portfolio_data(selected_stocks, from_date, to_date)
+        missing = [stock for stock in selected_stocks if stock not in returns_df.columns]
+        if returns_df.empty or missing:
+            return jsonify({'success': False, 'error': f"No data available for: {', '.join(missing or selected_stocks)}"})
+        n_portfolios = int(data.get('portfolios', 50))
+        resampled = resampled_frontier(returns_df, int(data.get('bootstraps', 100)), n_portfolios, data.get('seed'))
+        sample = cached_efficient_frontier(PortfolioModel(returns_df), n_portfolios)
+        return jsonify(dict(resampled, success=True, symbols=selected_stocks,
+                            sample={'frontier': sample['frontier'], 'optimal': sample['optimal']}))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/jobs/analyze', methods=['POST'])
+def submit_analysis_job():
+    """Queue an analysis and return its job id immediately"""
+    try:
+        job_id, created = job_manager.submit('analyze', request.json)
+        return jsonify({'success': True, 'job_id': job_id, 'deduplicated': not created}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/get_stock_performance', methods=['POST'])
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status, per-stage progress and, once done, the analysis payload"""
+    job = job_manager.store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({
+        'success': True,
+        'job': {
+            'id': job['id'],
+            'status': job['status'],
+            'progress': json.loads(job['progress'] or '{}'),
+            'result': json.loads(job['result']) if job['result'] else None,
+            'error': job['error']
+        }
+    })
+
+@app.route('/get_stock_performance', methods=['GET', 'POST'])
 def get_stock_performance():
     """Get individual stock performance"""
     try:
-        # Fetch data
-        stock_data, returns_df = prepare_portfolio_data()
-        if returns_df.empty:
-            return jsonify({'success': False, 'error': 'No valid stock data available'})
-        
-        performance = {}
-        for symbol in STOCKS.keys():
-            if symbol in returns_df.columns:
-                returns = returns_df[symbol]
-                annual_return = returns.mean() * 252 * 100
-                annual_vol = returns.std() * np.sqrt(252) * 100
-                sharpe = (annual_return - 6) / annual_vol
-                
-                performance[symbol] = {
-                    'return': float(round(annual_return, 2)),
-                    'risk': float(round(annual_vol, 2)),
-                    'sharpe': float(round(sharpe, 3))
-                }
+        # Built by the data refresh; only computed here before the first build. A table
+        # older than the last close is still served while it is rebuilt in the background.
+        current = stock_stats.current
+        if current is None:
+            stock_data, returns_df = prepare_portfolio_data()
+            if returns_df.empty:
+                return jsonify({'success': False, 'error': 'No valid stock data available'})
+            current = stock_stats.update(returns_df)
+        elif stock_stats.is_stale():
+            stock_stats.rebuild_in_background()
         
-        return jsonify({'success': True, 'performance': performance})
+        version, performance, as_of = current
+        response = jsonify({'success': True, 'performance': performance})
+        response.set_etag(version)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -725,8 +2910,20 @@ HTML_TEMPLATE = """
             });
         });
         
-        // Analyze portfolio
-        async function analyzePortfolio() {
+        // Frontier chart layout; the chart is filled in as the analysis streams in
+        const frontierLayout = {
+            title: 'Efficient Frontier Analysis',
+            xaxis: {title: 'Risk (Annual Volatility %)'},
+            yaxis: {title: 'Return (Annual %)'},
+            height: 500,
+            hovermode: 'closest'
+        };
+        
+        // Stream of the analysis in progress, closed when a new one starts
+        let currentSource = null;
+        
+        // Analyze portfolio, rendering each part as the server streams it
+        function analyzePortfolio() {
             // Get selected stocks
             const selectedStocks = [];
             document.querySelectorAll('#stockList input[type="checkbox"]:checked').forEach(checkbox => {
@@ -751,38 +2948,103 @@ HTML_TEMPLATE = """
             
             // Show loading
             const resultsDiv = document.getElementById('results');
-            resultsDiv.innerHTML = '<div class="loading"><div class="spinner"></div>Analyzing portfolio...</div>';
+            resultsDiv.innerHTML = '<div class="loading"><div class="spinner"></div>Loading market data...</div>';
             
-            try {
-                // Send request to analyze
-                const response = await fetch('/analyze', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        stocks: selectedStocks,
-                        weights: weights,
-                        optimization: optimization
-                    })
-                });
-                
-                const data = await response.json();
-                
+            const params = new URLSearchParams({
+                stocks: selectedStocks.join(','),
+                optimization: optimization,
+                weights: JSON.stringify(weights)
+            });
+            if (currentSource) {
+                currentSource.close();
+            }
+            const source = new EventSource(`/analyze/stream?${params}`);
+            currentSource = source;
+            let finished = false;
+            
+            source.addEventListener('cloud', event => {
+                const cloud = JSON.parse(event.data);
+                showResultsLayout();
+                Plotly.newPlot('frontierChart', [
+                    {
+                        type: 'scatter',
+                        x: cloud.risks,
+                        y: cloud.returns,
+                        mode: 'markers',
+                        name: 'Random Portfolios',
+                        marker: {
+                            size: 5,
+                            color: cloud.sharpes,
+                            colorscale: 'Viridis',
+                            showscale: true,
+                            colorbar: {title: 'Sharpe Ratio'}
+                        }
+                    },
+                    {type: 'scatter', x: [], y: [], mode: 'lines', name: 'Efficient Frontier',
+                     line: {color: 'red', width: 3}},
+                    {type: 'scatter', x: [], y: [], mode: 'markers', name: 'Max Sharpe',
+                     marker: {size: 15, color: 'red', symbol: 'star'}},
+                    {type: 'scatter', x: [], y: [], mode: 'markers', name: 'Min Risk',
+                     marker: {size: 15, color: 'green', symbol: 'star'}},
+                    {type: 'scatter', x: [], y: [], mode: 'markers', name: 'Your Portfolio',
+                     marker: {size: 15, color: 'blue', symbol: 'diamond'}}
+                ], frontierLayout);
+            });
+            
+            source.addEventListener('point', event => {
+                const point = JSON.parse(event.data);
+                Plotly.extendTraces('frontierChart', {x: [[point.risk]], y: [[point.return]]}, [1]);
+            });
+            
+            source.addEventListener('optimal', event => {
+                const optimal = JSON.parse(event.data);
+                Plotly.extendTraces('frontierChart', {
+                    x: [[optimal.max_sharpe.metrics.risk], [optimal.min_risk.metrics.risk]],
+                    y: [[optimal.max_sharpe.metrics.return], [optimal.min_risk.metrics.return]]
+                }, [2, 3]);
+                displayRecommendations(optimal);
+            });
+            
+            source.addEventListener('result', event => {
+                finished = true;
+                source.close();
+                const data = JSON.parse(event.data);
                 if (data.success) {
-                    displayResults(data);
+                    displayPortfolio(data);
                 } else {
                     resultsDiv.innerHTML = `<div class="loading">Error: ${data.error}</div>`;
                 }
-            } catch (error) {
-                resultsDiv.innerHTML = `<div class="loading">Error: ${error.message}</div>`;
-            }
+            });
+            
+            source.onerror = () => {
+                source.close();
+                if (!finished) {
+                    resultsDiv.innerHTML = '<div class="loading">Error: connection to the server was lost</div>';
+                }
+            };
         }
         
-        // Display results
-        function displayResults(data) {
-            const resultsDiv = document.getElementById('results');
-            
+        // Placeholders for the parts of the results that arrive later
+        function showResultsLayout() {
+            document.getElementById('results').innerHTML = `
+                <div id="portfolioMetrics">
+                    <div class="loading"><div class="spinner"></div>Optimizing portfolio...</div>
+                </div>
+                <div class="chart-container">
+                    <div id="allocationChart"></div>
+                </div>
+                <div class="chart-container">
+                    <div id="frontierChart"></div>
+                </div>
+                <div id="allocationTable"></div>
+                <div id="recommendations"></div>
+            `;
+        }
+        
+        // Display the user's portfolio
+        function displayPortfolio(data) {
             // Create metrics cards
-            const metricsHTML = `
+            document.getElementById('portfolioMetrics').innerHTML = `
                 <div class="metrics-grid">
                     <div class="metric-card">
                         <h3>Expected Return</h3>
@@ -810,49 +3072,42 @@ HTML_TEMPLATE = """
                 `;
             }
             allocationHTML += '</table></div>';
+            document.getElementById('allocationTable').innerHTML = allocationHTML;
             
-            // Create charts
-            const chartsHTML = `
-                <div class="chart-container">
-                    <div id="allocationChart"></div>
-                </div>
-                <div class="chart-container">
-                    <div id="frontierChart"></div>
-                </div>
-            `;
-            
-            // Create recommendations
-            const recoHTML = `
+            // Render charts
+            Plotly.newPlot('allocationChart', data.charts.allocation.data, data.charts.allocation.layout);
+            Plotly.extendTraces('frontierChart', {
+                x: [[data.portfolio.metrics.risk]],
+                y: [[data.portfolio.metrics.return]]
+            }, [4]);
+        }
+        
+        // Display the optimal portfolios
+        function displayRecommendations(optimal) {
+            document.getElementById('recommendations').innerHTML = `
                 <div class="recommendations">
                     <h3>Recommendations</h3>
                     <div class="recommendation-item">
                         <strong>Optimal Portfolio (Max Sharpe):</strong><br>
-                        Return: ${data.optimal.max_sharpe.metrics.return.toFixed(2)}%, 
-                        Risk: ${data.optimal.max_sharpe.metrics.risk.toFixed(2)}%, 
-                        Sharpe: ${data.optimal.max_sharpe.metrics.sharpe.toFixed(3)}
+                        Return: ${optimal.max_sharpe.metrics.return.toFixed(2)}%, 
+                        Risk: ${optimal.max_sharpe.metrics.risk.toFixed(2)}%, 
+                        Sharpe: ${optimal.max_sharpe.metrics.sharpe.toFixed(3)}
                     </div>
                     <div class="recommendation-item">
                         <strong>Conservative Portfolio (Min Risk):</strong><br>
-                        Return: ${data.optimal.min_risk.metrics.return.toFixed(2)}%, 
-                        Risk: ${data.optimal.min_risk.metrics.risk.toFixed(2)}%, 
-                        Sharpe: ${data.optimal.min_risk.metrics.sharpe.toFixed(3)}
+                        Return: ${optimal.min_risk.metrics.return.toFixed(2)}%, 
+                        Risk: ${optimal.min_risk.metrics.risk.toFixed(2)}%, 
+                        Sharpe: ${optimal.min_risk.metrics.sharpe.toFixed(3)}
                     </div>
                 </div>
             `;
-            
-            // Update results
-            resultsDiv.innerHTML = metricsHTML + chartsHTML + allocationHTML + recoHTML;
-            
-            // Render charts
-            Plotly.newPlot('allocationChart', data.charts.allocation.data, data.charts.allocation.layout);
-            Plotly.newPlot('frontierChart', data.charts.frontier.data, data.charts.frontier.layout);
         }
         
         // Initialize on load
         initializeStocks();
         
         // Load initial performance
-        fetch('/get_stock_performance', {method: 'POST'})
+        fetch('/get_stock_performance')
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
@@ -890,8 +3145,3 @@ if __name__ == '__main__':
     
     app.run(debug=True, port=5000)
 
-    from dotenv import load_dotenv
-import os
-
-load_dotenv()
-api_key = os.getenv("API_KEY")
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+BENCHMARKS - SLSQP gradients, factor-model risk and end-to-end /analyze latency
+Runs optimize_portfolio on synthetic returns panels (analytic gradients vs
+finite differences), compares dense and factor-model risk evaluation, then
+times /analyze against the synthetic market-data provider, so no Kite
+credentials or network are needed.
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+import app as webapp
+from app import FactorModel, PortfolioModel, _budget_constraint
+
+def synthetic_returns(n_assets, n_days=750, seed=0):
+    """Daily returns with a 3-factor correlation structure"""
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(0, 0.01, (n_assets, 3))
+    returns = (rng.normal(size=(n_days, 3)) @ loadings.T
+               + rng.normal(0, 0.012, (n_days, n_assets))
+               + rng.normal(0.0008, 0.0004, n_assets))
+    return pd.DataFrame(returns, columns=[f"S{i}" for i in range(n_assets)])
+
+def count_calls(model, name):
+    """Wrap a model method so calls to it are counted"""
+    method = getattr(model, name)
+    counter = {'calls': 0}
+    def wrapped(w):
+        counter['calls'] += 1
+        return method(w)
+    setattr(model, name, wrapped)
+    return counter
+
+def run(n_assets, optimization_type, analytic_gradients, repeats=5):
+    """SLSQP on -Sharpe or risk (optimize_portfolio itself now solves max-Sharpe as a QP)"""
+    model = PortfolioModel(synthetic_returns(n_assets))
+    if optimization_type == 'sharpe':
+        objective = lambda w: -model.sharpe(w)
+        gradient = lambda w: -model.sharpe_grad(w)
+        counter = count_calls(model, 'sharpe')
+    else:
+        objective = lambda w: model.risk(w) * 100
+        gradient = lambda w: model.risk_grad(w) * 100
+        counter = count_calls(model, 'risk')
+    start = time.perf_counter()
+    for _ in range(repeats):
+        minimize(objective, np.ones(n_assets) / n_assets,
+                 jac=gradient if analytic_gradients else None, method='SLSQP',
+                 bounds=[(0, 1)] * n_assets, constraints=[_budget_constraint()])
+    elapsed = (time.perf_counter() - start) / repeats
+    return counter['calls'] / repeats, elapsed * 1000
+
+def risk_eval(model, repeats=200):
+    """Microseconds per risk + risk-gradient evaluation"""
+    w = np.ones(model.n_assets) / model.n_assets
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.risk(w)
+        model.risk_grad(w)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+def analyze_latency(symbols, optimization='max_sharpe', requests=20):
+    """Cold and warm /analyze latency in ms, served by the synthetic provider"""
+    webapp.market_data = webapp.SyntheticProvider()
+    webapp.frontier_cache.clear()
+    client = webapp.app.test_client()
+    payload = {'stocks': symbols, 'optimization': optimization}
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.post('/analyze', json=payload).get_json()
+        timings.append((time.perf_counter() - start) * 1000)
+        if not response['success']:
+            raise RuntimeError(response['error'])
+    return timings[0], float(np.median(timings[1:]))
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [5, 20, 50, 100]
+    print(f"{'assets':>6} {'objective':>9} | {'FD evals':>9} {'FD ms':>8} | {'jac evals':>9} {'jac ms':>8} | {'speedup':>7}")
+    for n_assets in sizes:
+        for optimization_type in ('sharpe', 'min_risk'):
+            fd_evals, fd_ms = run(n_assets, optimization_type, analytic_gradients=False)
+            jac_evals, jac_ms = run(n_assets, optimization_type, analytic_gradients=True)
+            print(f"{n_assets:>6} {optimization_type:>9} | {fd_evals:>9.0f} {fd_ms:>8.2f} | "
+                  f"{jac_evals:>9.0f} {jac_ms:>8.2f} | {fd_ms / jac_ms:>6.1f}x")
+
+    print(f"\n{'assets':>6} | {'dense us':>9} {'factor us':>9} | {'dense MB':>8} {'factor MB':>9}   (risk + gradient)")
+    for n_assets in sizes:
+        returns = synthetic_returns(n_assets)
+        dense, factor = PortfolioModel(returns), FactorModel(returns)
+        print(f"{n_assets:>6} | {risk_eval(dense):>9.1f} {risk_eval(factor):>9.1f} | "
+              f"{(dense.Sigma.nbytes + dense.L.nbytes) / 1e6:>8.2f} {(factor.B.nbytes + factor.d.nbytes) / 1e6:>9.3f}")
+
+    print(f"\n{'assets':>6} | {'cold ms':>8} {'warm ms':>8}   (/analyze, synthetic provider)")
+    for n_assets in sizes:
+        cold_ms, warm_ms = analyze_latency([f"S{i}" for i in range(n_assets)])
+        print(f"{n_assets:>6} | {cold_ms:>8.1f} {warm_ms:>8.1f}")
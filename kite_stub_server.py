@@ -0,0 +1,154 @@
+"""
+KITE STUB SERVER - local stand-in for the Kite Connect API
+Serves /instruments, /user/profile and /instruments/historical with
+configurable latency, jitter, rate limiting (429) and error injection.
+
+Point the app at it with:
+    KITE_ROOT_URL=http://localhost:8765 KITE_ACCESS_TOKEN=stub python app.py
+"""
+
+import argparse
+import csv
+import io
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import app as webapp
+
+INSTRUMENT_FIELDS = ['instrument_token', 'exchange_token', 'tradingsymbol', 'name', 'last_price', 'expiry',
+                     'strike', 'tick_size', 'lot_size', 'instrument_type', 'segment', 'exchange']
+
+class StubState:
+    """Shared server configuration, candle source and rate-limit window"""
+
+    def __init__(self, args):
+        self.latency = args.latency / 1000
+        self.jitter = args.jitter / 1000
+        self.rate_limit = args.rate_limit
+        self.error_rate = args.error_rate
+        self.recorded = args.recorded
+        self.synthetic = webapp.SyntheticProvider(seed=args.seed)
+        self.symbols = {info['token']: symbol for symbol, info in webapp.STOCKS.items()}
+        self.requests = deque()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+
+    def throttled(self):
+        """True if this historical request exceeds the per-second limit"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.requests and now - self.requests[0] >= 1:
+                self.requests.popleft()
+            if len(self.requests) >= self.rate_limit:
+                self.stats['throttled'] += 1
+                return True
+            self.requests.append(now)
+            return False
+
+    def candles(self, token, from_date, to_date):
+        """Candles in Kite's wire format, from the OHLC cache or the synthetic provider"""
+        df = None
+        if self.recorded:
+            cached = webapp.load_cached_ohlc(token)
+            if cached is not None:
+                df = cached[0]
+                df = df[(df.index >= from_date.replace(hour=0, minute=0, second=0)) & (df.index <= to_date)]
+        if df is None:
+            symbol = self.symbols.get(token, str(token))
+            df = self.synthetic.fetch([symbol], from_date, to_date)[symbol]
+        if df is None:
+            return []
+        return [
+            [date.strftime('%Y-%m-%dT%H:%M:%S+0530'), row.open, row.high, row.low, row.close, int(row.volume)]
+            for date, row in zip(df.index, df.itertuples())
+        ]
+
+def make_handler(state):
+    class KiteStubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json'):
+            payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _error(self, status, error_type, message):
+            self._send(status, {'status': 'error', 'error_type': error_type, 'message': message, 'data': None})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split('/') if part]
+            with state.lock:
+                state.stats['requests'] += 1
+            time.sleep(max(0.0, random.gauss(state.latency, state.jitter)))
+
+            if parts[:2] == ['instruments', 'historical'] and len(parts) == 4:
+                if state.throttled():
+                    return self._error(429, 'NetworkException', 'Too many requests')
+                if random.random() < state.error_rate:
+                    with state.lock:
+                        state.stats['errors'] += 1
+                    return self._error(500, 'GeneralException', 'Injected error')
+                try:
+                    token = int(parts[2])
+                    from_date = datetime.strptime(params['from'], '%Y-%m-%d %H:%M:%S')
+                    to_date = datetime.strptime(params['to'], '%Y-%m-%d %H:%M:%S')
+                except (KeyError, ValueError) as e:
+                    return self._error(400, 'InputException', f"Invalid request: {e}")
+                return self._send(200, {'status': 'success', 'data': {'candles': state.candles(token, from_date, to_date)}})
+
+            if parts and parts[0] == 'instruments':
+                exchange = parts[1] if len(parts) > 1 else 'NSE'
+                out = io.StringIO()
+                writer = csv.DictWriter(out, fieldnames=INSTRUMENT_FIELDS)
+                writer.writeheader()
+                for symbol, info in webapp.STOCKS.items():
+                    writer.writerow({
+                        'instrument_token': info['token'], 'exchange_token': info['token'] >> 8,
+                        'tradingsymbol': symbol, 'name': info['name'], 'last_price': 0, 'expiry': '',
+                        'strike': 0, 'tick_size': 0.05, 'lot_size': 1, 'instrument_type': 'EQ',
+                        'segment': exchange, 'exchange': exchange
+                    })
+                return self._send(200, out.getvalue().encode(), content_type='text/csv')
+
+            if parts == ['user', 'profile']:
+                return self._send(200, {'status': 'success', 'data': {'user_id': 'STUB01', 'user_name': 'Kite Stub'}})
+
+            if parts == ['stats']:
+                return self._send(200, state.stats)
+
+            self._error(404, 'GeneralException', f"Route not found: {url.path}")
+
+    return KiteStubHandler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=150, help='mean response latency in ms')
+    parser.add_argument('--jitter', type=float, default=50, help='latency standard deviation in ms')
+    parser.add_argument('--rate-limit', type=int, default=3, help='historical requests per second before 429 (0 = off)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of historical requests failing with 500')
+    parser.add_argument('--recorded', action='store_true', help='serve candles from the OHLC cache when available')
+    parser.add_argument('--seed', type=int, default=42, help='seed for synthetic candles')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args)))
+    print(f"Kite stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()